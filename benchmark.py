@@ -0,0 +1,314 @@
+r"""
+Reproducible benchmarks for the invariants and searches in inp.py.
+
+Every bound and alpha property in ``INPGraph`` is timed over fixed graph6
+corpora, together with ``is_difficult``, ``survey`` and the difficult graph
+search at fixed orders. Results are written as JSON and may be compared
+against a saved baseline::
+
+    sage -python benchmark.py --output results.json
+    sage -python benchmark.py --baseline results.json
+
+The corpora are all ``-cd3D{n-2}`` graphs for each order ``n`` in
+``geng_orders`` (the graphs searched by ``survey``), the named graphs, and
+G(n,p) samples generated from a fixed seed.
+"""
+
+import sys
+sys.path.append(".") # Needed to pass Sage's automated testing
+
+from sage.all import *
+from inp import INPGraph
+from sage.combinat.matrices.latin import back_circulant
+from collections import OrderedDict
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import time
+
+geng_orders = [7, 8, 9]
+random_orders = [10, 12, 14]
+random_edge_probability = 0.3
+random_samples = 20
+random_seed = 2012
+
+def named_corpus():
+    r"""
+    Return the graph6 strings of the named graphs.
+
+    EXAMPLES:
+
+    ::
+        sage: INPGraph(named_corpus()['KillerGraph']).is_difficult()
+        False
+    """
+    named = OrderedDict()
+    named['KillerGraph'] = INPGraph.KillerGraph()
+    named['ChairGraph'] = INPGraph.ChairGraph()
+    named['CoChairGraph'] = INPGraph.CoChairGraph()
+    named['PGraph'] = INPGraph.PGraph()
+    named['CoPGraph'] = INPGraph.CoPGraph()
+    named['GemGraph'] = INPGraph.GemGraph()
+    named['SkewStar'] = INPGraph.SkewStar()
+    named['SuperClaw(2,3,4)'] = INPGraph.SuperClaw(2, 3, 4)
+    named['PetersenGraph'] = INPGraph(graphs.PetersenGraph())
+    named['LatinSquareGraph(back_circulant(4))'] = INPGraph.LatinSquareGraph(back_circulant(4))
+    return OrderedDict((name, g.graph6_string()) for name, g in named.iteritems())
+
+def geng_corpus(order):
+    r"""
+    Return the graph6 strings of the graphs of the given order searched by
+    :meth:`INPGraph.survey`, in the order nauty generates them.
+    """
+    return [g.graph6_string() for g in INPGraph.corpus(order)]
+
+def random_corpus(order, p=random_edge_probability, samples=random_samples, seed=random_seed):
+    r"""
+    Return the graph6 strings of ``samples`` G(n,p) random graphs of the
+    given order. The random generator is seeded with a hash of ``seed``, the
+    order and ``p`` that does not depend on the Python build, so the corpus
+    is the same on every machine.
+
+    EXAMPLES:
+
+    ::
+        sage: random_corpus(10, samples=3) == random_corpus(10, samples=3)
+        True
+    """
+    digest = hashlib.sha1("{0}-{1}-{2}".format(seed, order, p)).hexdigest()
+    rng = random.Random(int(digest, 16))
+    corpus = []
+    for i in range(samples):
+        g = INPGraph(order)
+        g.add_edges((u, v) for u in range(order) for v in range(u+1, order) if rng.random() < p)
+        corpus.append(g.graph6_string())
+    return corpus
+
+def corpora():
+    r"""
+    Return the benchmark corpora as a dictionary of lists of graph6 strings.
+    """
+    c = OrderedDict()
+    for n in geng_orders:
+        c['geng-{0}'.format(n)] = geng_corpus(n)
+    c['named'] = named_corpus().values()
+    for n in random_orders:
+        c['gnp-{0}'.format(n)] = random_corpus(n)
+    return c
+
+def corpus_digest(corpus):
+    r"""
+    Return a hex digest of the graph6 strings of a corpus, to tell whether
+    two benchmark runs timed the same graphs.
+
+    EXAMPLES:
+
+    ::
+        sage: corpus_digest(['Bw', 'Cx']) == corpus_digest(['Bw', 'Cx'])
+        True
+        sage: corpus_digest(['Bw', 'Cx']) == corpus_digest(['Cx', 'Bw'])
+        False
+    """
+    return hashlib.sha1("\n".join(corpus)).hexdigest()
+
+def _best_of(repeat, run):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = run()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+def clear_caches():
+    r"""
+    Empty the per-class caches of the ``memoize_graphs`` methods of
+    ``INPGraph``, such as :meth:`INPGraph.matching_number`.
+    """
+    for attr in INPGraph.__dict__.itervalues():
+        cache = getattr(attr, '_cache', None)
+        if isinstance(cache, dict):
+            cache.clear()
+
+def time_function(func, corpus, repeat=3):
+    r"""
+    Time ``func`` over every graph in ``corpus``, taking the fastest of
+    ``repeat`` runs. Each run starts from freshly built graphs and empty
+    :func:`clear_caches` caches, so that no cached values are reused.
+    Returns a dictionary with the total time, the number of graphs and the
+    number of graphs on which ``func`` raised ``ValueError``.
+
+    EXAMPLES:
+
+    ::
+        sage: t = time_function(INPGraph.residue, named_corpus().values())
+        sage: t['graphs'], t['errors']
+        (10, 0)
+    """
+    def run():
+        clear_caches()
+        errors = 0
+        for g in [INPGraph(s) for s in corpus]:
+            try:
+                func(g)
+            except ValueError:
+                errors += 1
+        return errors
+
+    elapsed, errors = _best_of(repeat, run)
+    return {'time': elapsed, 'graphs': len(corpus), 'errors': errors}
+
+def _quietly(func, *args, **kwargs):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        return func(*args, **kwargs)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def benchmark_searches(repeat=1):
+    r"""
+    Time :meth:`INPGraph.survey` of one bound and one alpha property, and the
+    search for a difficult graph, at each order in ``geng_orders``.
+
+    The search is timed with ``_next_difficult_graph_of_order``, which stops
+    after the given order, so the benchmark does not depend on how far
+    ``next_difficult_graph`` has to look.
+    """
+    results = OrderedDict()
+    for n in geng_orders:
+        for func in [INPGraph.lovasz_theta, INPGraph.has_magnet]:
+            elapsed, _ = _best_of(repeat, lambda: _quietly(INPGraph.survey, func, n))
+            results['survey({0}, {1})'.format(func.__name__, n)] = {'time': elapsed, 'corpus': 'geng-{0}'.format(n)}
+
+        elapsed, g = _best_of(repeat, lambda: INPGraph._next_difficult_graph_of_order(n, verbose=False))
+        results['next_difficult_graph({0})'.format(n)] = {'time': elapsed, 'corpus': 'geng-{0}'.format(n),
+                                                          'found': None if g is None else g.graph6_string()}
+    return results
+
+def run_benchmarks(repeat=3, searches=True):
+    r"""
+    Run the benchmark suite and return the results as a dictionary that can
+    be written as JSON.
+    """
+    functions = INPGraph._alpha_properties + INPGraph._lower_bounds + INPGraph._upper_bounds
+    functions = functions + [INPGraph.independence_number, INPGraph.is_difficult]
+
+    results = OrderedDict()
+    results['meta'] = OrderedDict([
+        ('date', time.strftime("%Y-%m-%d %H:%M:%S")),
+        ('sage', version()),
+        ('python', platform.python_version()),
+        ('machine', platform.platform()),
+        ('repeat', repeat),
+        ('seed', random_seed),
+    ])
+
+    timings = OrderedDict()
+    c = corpora()
+    results['meta']['corpora'] = OrderedDict((name, corpus_digest(corpus)) for name, corpus in c.iteritems())
+    for corpus_name, corpus in c.iteritems():
+        for func in functions:
+            sys.stdout.write("Timing {0} on {1}...\r".format(func.__name__, corpus_name))
+            sys.stdout.flush()
+            timing = time_function(func, corpus, repeat)
+            timing['corpus'] = corpus_name
+            timings['{0}/{1}'.format(func.__name__, corpus_name)] = timing
+    print
+
+    if searches:
+        timings.update(benchmark_searches(repeat))
+
+    results['timings'] = timings
+    return results
+
+def compare(results, baseline, tolerance=0.25, min_time=0.01):
+    r"""
+    Compare benchmark results against a baseline. Returns a list of
+    ``(name, baseline_time, time)`` for every benchmark that became more than
+    ``tolerance`` slower; benchmarks faster than ``min_time`` seconds in the
+    baseline are too noisy to compare and are ignored. So are the timings on
+    a corpus whose digest differs from the baseline's, see
+    :func:`changed_corpora`.
+
+    EXAMPLES:
+
+    ::
+        sage: old = {'timings': {'a': {'time': 1.0}, 'b': {'time': 1.0}}}
+        sage: new = {'timings': {'a': {'time': 1.1}, 'b': {'time': 2.0}}}
+        sage: compare(new, old)
+        [('b', 1.0, 2.0)]
+
+        sage: old = {'meta': {'corpora': {'x': '0'}}, 'timings': {'f/x': {'time': 1.0, 'corpus': 'x'}}}
+        sage: new = {'meta': {'corpora': {'x': '1'}}, 'timings': {'f/x': {'time': 2.0, 'corpus': 'x'}}}
+        sage: compare(new, old)
+        []
+    """
+    changed = changed_corpora(results, baseline)
+    regressions = []
+    for name, timing in sorted(results['timings'].iteritems()):
+        if name not in baseline['timings']:
+            continue
+        if timing.get('corpus') in changed:
+            continue
+        old = baseline['timings'][name]['time']
+        if old >= min_time and timing['time'] > old * (1 + tolerance):
+            regressions.append((name, old, timing['time']))
+    return regressions
+
+def changed_corpora(results, baseline):
+    r"""
+    Return the sorted names of the corpora whose digest differs between the
+    results and the baseline, or which only one of them has. Results without
+    digests are assumed to match.
+
+    EXAMPLES:
+
+    ::
+        sage: old = {'meta': {'corpora': {'x': '0', 'y': '0'}}}
+        sage: new = {'meta': {'corpora': {'x': '0', 'y': '1', 'z': '0'}}}
+        sage: changed_corpora(new, old)
+        ['y', 'z']
+    """
+    new = results.get('meta', {}).get('corpora')
+    old = baseline.get('meta', {}).get('corpora')
+    if new is None or old is None:
+        return []
+    return sorted(name for name in set(new) | set(old) if new.get(name) != old.get(name))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the invariants and searches in inp.py.")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--baseline', help="compare the results against this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown before reporting a regression")
+    parser.add_argument('--repeat', type=int, default=3, help="time each benchmark this many times and keep the fastest")
+    parser.add_argument('--no-searches', action='store_true', help="skip the survey and search benchmarks")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.repeat, not args.no_searches)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for name in changed_corpora(results, baseline):
+            print "Corpus {0} differs from the baseline; its timings are not compared.".format(name)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, old, new in regressions:
+            print "{0}: {1:.3f}s -> {2:.3f}s ({3:+.0%})".format(name, old, new, new/old - 1)
+        if regressions:
+            return 1
+        print "No regressions."
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
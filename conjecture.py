@@ -2,10 +2,94 @@ import sys
 sys.path.append(".") # Needed to pass Sage's automated testing
 
 from sage.all import *
-from inp import INPGraph
+from inp import INPGraph, GraphDeduplicator
+from collections import OrderedDict
 import itertools
+import math
 import operator
 
+class _BoundedValues(OrderedDict):
+    # A dictionary that discards its oldest entry once it holds more than
+    # max_entries entries.
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries
+        OrderedDict.__init__(self)
+
+    def __setitem__(self, key, value):
+        OrderedDict.__setitem__(self, key, value)
+        if self.max_entries is not None and len(self) > self.max_entries:
+            self.popitem(last=False)
+
+class GraphCache(object):
+    r"""
+    A bounded cache of values computed for graphs. Entries are keyed by the
+    graph6 string of the graph, so a value can never be served for a
+    different graph that happens to reuse the memory of a freed one. When
+    more than ``max_graphs`` graphs are cached, the least recently used
+    graph's values are discarded, and each graph keeps at most
+    ``max_entries`` values, discarding the oldest first.
+
+    EXAMPLES:
+
+    ::
+        sage: cache = GraphCache(max_graphs=1)
+        sage: g, h = INPGraph(graphs.PetersenGraph()), INPGraph.KillerGraph()
+        sage: cache.values(g)['alpha'] = 4
+        sage: cache.values(h)['alpha'] = 4
+        sage: g in cache, h in cache
+        (False, True)
+        sage: cache = GraphCache(max_entries=2)
+        sage: values = cache.values(g)
+        sage: for i in range(3):
+        ....:     values[i] = i
+        sage: values.keys()
+        [1, 2]
+    """
+
+    def __init__(self, max_graphs=None, max_entries=None):
+        self.max_graphs = max_graphs
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, g):
+        return self.key(g) in self._data
+
+    def key(self, g):
+        return g.graph6_string()
+
+    def values(self, g, key=None):
+        r"""
+        Return the dictionary of cached values for the graph, creating it if
+        needed. The graph's key may be passed in to avoid recomputing it.
+        """
+        if key is None:
+            key = self.key(g)
+
+        try:
+            values = self._data.pop(key)
+        except KeyError:
+            values = _BoundedValues(self.max_entries)
+        self._data[key] = values
+
+        if self.max_graphs is not None:
+            while len(self._data) > self.max_graphs:
+                self._data.popitem(last=False)
+
+        return values
+
+    def invalidate(self, g=None):
+        r"""
+        Forget the cached values for the graph, or for every graph if none is
+        given. Call this after mutating a graph that has been cached.
+        """
+        if g is None:
+            self._data.clear()
+        else:
+            self._data.pop(self.key(g), None)
+
 class GraphBrain(SageObject):
     # Don't add Graph.wiener_index to the graph invariants, it causes a bug when
     # creating a symbolic function in GraphExpression.expression() for reasons unknown.
@@ -21,9 +105,17 @@ class GraphBrain(SageObject):
     _default_binary_commutative_operators = [operator.add, operator.mul]
     _default_binary_noncommutative_operators = [operator.sub, operator.truediv]
 
+    # Floating point versions of operators used when evaluating numerically.
+    # Operators not listed here are applied to floats directly.
+    _float_operators = {sqrt: math.sqrt}
+
     _complexity_limit = 10
-    _eval_cache = {}
-    _invariant_cache = {}
+    _cache_size_limit = 4096
+    # The most expression values kept for each graph.
+    _cache_entries_limit = 16384
+    # Comparisons closer than this (relative to the target) are decided
+    # using exact values instead of floats.
+    _epsilon = 1e-9
     _save_path = os.path.expanduser("~/Dropbox/INP")
 
     def __init__(self, name=None, comparator=operator.le, graphs=[],
@@ -36,36 +128,213 @@ class GraphBrain(SageObject):
         self.comparator = comparator
         self.target = target
 
+        # graphs may be any iterable of graphs, such as a GraphCorpus.
+        graphs = list(graphs)
         if not all(isinstance(g, INPGraph) for g in graphs):
             raise TypeError("Graphs must be INPGraph objects.")
         else:
             self.graphs = graphs
+        # Remembers the graphs in the brain up to isomorphism for add_graphs,
+        # see _sync_deduplicator().
+        self._deduplicator = None
+        self._deduplicated = None
 
         self.graph_invariants = graph_invariants
         self.unary_operators = unary_operators
         self.binary_commutative_operators = binary_commutative_operators
         self.binary_noncommutative_operators = binary_noncommutative_operators
 
+        self._eval_cache = GraphCache(self._cache_size_limit, self._cache_entries_limit)
+        self._invariant_cache = GraphCache(self._cache_size_limit)
+
+        # State kept between calls to conjecture(), see add_graphs().
+        self._search_settings = None
+        self._refutations = {}
+        self._significance = {}
+
+    def clear_cache(self, g=None):
+        r"""
+        Forget the cached invariant and expression values of the given graph,
+        or of every graph if none is given.
+        """
+        self._eval_cache.invalidate(g)
+        self._invariant_cache.invalidate(g)
+
     def _repr_(self):
         return "Name: {0}\nComparator: {1}\nGraphs: {2}\nTarget: {3}\nGraph invariants: {4}\nUnary operators: {5}\nBinary commutative operators: {6}\nBinary noncommutative operators:{7}".format(
             self.name, self.comparator, self.graphs, self.target, self.graph_invariants, self.unary_operators, self.binary_commutative_operators, self.binary_noncommutative_operators)
 
+    def add_graphs(self, graphs):
+        r"""
+        Add graphs to the brain, ignoring any that are isomorphic to a graph
+        already in it or to an earlier new graph (see :class:`GraphDeduplicator`),
+        without discarding what previous searches learned. The graphs the brain
+        was created with, or that were put in ``graphs`` directly, are kept
+        as they are, even if some of them are isomorphic. Expressions refuted by a
+        graph in the brain stay refuted, and the significant conjectures found
+        earlier only have to be checked against the new graphs, so calling
+        :meth:`conjecture` again is cheap.
+
+        EXAMPLES:
+
+        ::
+            sage: brain = GraphBrain(graphs=[INPGraph(graphs.PetersenGraph())])
+            sage: brain.add_graphs([INPGraph.KillerGraph(), INPGraph(graphs.PetersenGraph())])
+            sage: len(brain.graphs)
+            2
+            sage: brain.add_graphs([INPGraph.SuperClaw(1, 2, 3), INPGraph.SkewStar()])
+            sage: len(brain.graphs)
+            3
+
+        Graphs appended to ``graphs`` directly are remembered as well::
+
+            sage: brain.graphs.append(INPGraph(graphs.CycleGraph(5)))
+            sage: brain.add_graphs([INPGraph(graphs.CycleGraph(5))])
+            sage: len(brain.graphs)
+            4
+
+        The graphs can also be read from a :class:`GraphCorpus`::
+
+            sage: brain.add_graphs(INPGraph.corpus(6))
+            sage: len(brain.graphs)
+            12
+        """
+        graphs = list(graphs)
+        if not all(isinstance(g, INPGraph) for g in graphs):
+            raise TypeError("Graphs must be INPGraph objects.")
+
+        self._sync_deduplicator()
+        self.graphs.extend(self._deduplicator.filter(graphs))
+        self._deduplicated = (self.graphs, len(self.graphs))
+
+    def _sync_deduplicator(self):
+        # The deduplicator is built on the first call to add_graphs, and
+        # rebuilt if graphs was replaced or shortened since. Graphs appended
+        # to it directly are remembered without being filtered.
+        if self._deduplicated is not None:
+            graphs, count = self._deduplicated
+            if graphs is self.graphs and count <= len(self.graphs):
+                for g in self.graphs[count:]:
+                    self._deduplicator.add(g)
+                return
+
+        self._deduplicator = GraphDeduplicator(self.graphs)
+
+    def _target_value(self, g, key):
+        values = self._invariant_cache.values(g, key)
+        if ('target', self.target) not in values:
+            values[('target', self.target)] = self.target(g)
+        return values[('target', self.target)]
+
+    def _compare(self, expr, g, target, key=None):
+        r"""
+        Return whether the expression compares true against the target for the
+        graph, together with its value as a float. The comparison is done in
+        floating point unless the value falls within ``_epsilon`` of the
+        target, or cannot be computed in floating point, in which case the
+        exact value of the expression decides. The graph's cache key may be
+        passed in to avoid recomputing it.
+        """
+        try:
+            value = expr.evaluate(g, numeric=True, use_cache=True, key=key)
+        except (ArithmeticError, ValueError, TypeError):
+            value = None
+
+        float_target = float(target)
+        if value is not None and abs(value - float_target) > self._epsilon * max(1.0, abs(float_target)):
+            return bool(self.comparator(value, float_target)), value
+
+        exact = expr.evaluate(g, use_cache=True, key=key)
+        if bool(exact == target):
+            return bool(self.comparator(target, target)), float_target
+        return bool(self.comparator(exact, target)), float(exact)
+
+    def _evaluations(self, expr, graphs, targets, debug=False):
+        r"""
+        Return a dictionary of the values of the expression on the given
+        ``(key, graph)`` pairs if the expression is true for all of them, and
+        None otherwise. The first graph that refutes the expression is
+        remembered so later searches can skip the expression entirely.
+        """
+        evaluations = {}
+
+        for key, g in graphs:
+            try:
+                true_for_this_graph, evaluation = self._compare(expr, g, targets[key], key)
+                if debug: print "\t->", g.graph6_string(), "=", evaluation
+            except Exception as e:
+                true_for_this_graph = False
+                if debug: print e
+
+            if not true_for_this_graph:
+                if debug: print "\tFalse for", g.graph6_string()
+                self._refutations[expr.key()] = key
+                return None
+
+            evaluations[key] = evaluation
+
+        return evaluations
+
     # @profile
     def conjecture(self, verbose=True, debug=False):
         r"""
         Return a list of true statements that are also significant for at least
         one graph in the brain, that is, the statement gives the tightest bound.
+
+        The results of earlier calls are reused: expressions refuted by a
+        graph still in the brain are skipped, and previously significant
+        conjectures are kept as long as they hold for any graphs added since.
+
+        EXAMPLES:
+
+        After :meth:`add_graphs`, the conjectures still hold on every graph,
+        the earlier refutations are kept, and the conjectures are those a new
+        brain finds on the same graphs. ::
+
+            sage: settings = dict(graph_invariants=[Graph.order, Graph.radius, INPGraph.min_degree], unary_operators=[], binary_commutative_operators=[operator.add], binary_noncommutative_operators=[operator.sub])
+            sage: brain = GraphBrain(graphs=[INPGraph(graphs.PetersenGraph()), INPGraph.KillerGraph()], **settings)
+            sage: first = brain.conjecture(verbose=False)
+            sage: refutations = dict(brain._refutations)
+            sage: brain.add_graphs([INPGraph(graphs.CycleGraph(5)), INPGraph.SkewStar()])
+            sage: second = brain.conjecture(verbose=False)
+            sage: all(brain.comparator(expr.evaluate(g), brain.target(g)) for expr in second for g in brain.graphs)
+            True
+            sage: all(brain._refutations[key] == refutations[key] for key in refutations)
+            True
+            sage: fresh = GraphBrain(graphs=brain.graphs, **settings)
+            sage: set(expr.key() for expr in second) == set(expr.key() for expr in fresh.conjecture(verbose=False))
+            True
         """
         if not self.graphs:
             raise ValueError("There must be at least one graph in the brain.")
 
+        if self.comparator not in [operator.gt, operator.ge, operator.lt, operator.le]:
+            raise ValueError("Significance is not defined for this comparator.")
+
         if debug: verbose = False
-        complexity = 1
-        targets = {}
-        bingos = {}
+
+        # Refutations and significance only make sense for the comparator and
+        # target they were found with.
+        if self._search_settings != (self.comparator, self.target):
+            self._search_settings = (self.comparator, self.target)
+            self._refutations = {}
+            self._significance = {}
+
+        # Newly added graphs are the most likely to refute an expression, so
+        # they are tried first.
+        graphs = [(self._eval_cache.key(g), g) for g in reversed(self.graphs)]
+        present = set(key for key, g in graphs)
+        targets = dict((key, self._target_value(g, key)) for key, g in graphs)
+
         significance = {}
+        for key, entry in self._significance.iteritems():
+            if key in present and self._evaluations(entry['expression'], graphs, targets, debug) is not None:
+                significance[key] = entry
 
-        while not bingos or not all(bingos.values()) and complexity <= self._complexity_limit:
+        bingos = dict((key, key in significance and bool(significance[key]['value'] == targets[key])) for key in present)
+
+        complexity = 1
+        while not all(bingos.values()) and complexity <= self._complexity_limit:
 
             if debug: print "========== COMPLEXITY", complexity, "=========="
 
@@ -81,73 +350,31 @@ class GraphBrain(SageObject):
 
                 if debug: print expr
 
-                exprid = id(expr)
-                truth = []
-                possible_significance = {}
-                possible_bingos = {}
-
-                for g in self.graphs:
-
-                    gid = id(g)
-
-                    if debug: print "\t->", g.graph6_string(), "=",expr.evaluate(g)
-
-                    if gid not in targets:
-                        targets[gid] = self.target(g)
-
-                    if gid not in bingos:
-                        bingos[gid] = False
-
-                    try:
-                        evaluation = expr.evaluate(g, numeric=True, use_cache=True)
-                        target = targets[gid]
-                        true_for_this_graph = bool(self.comparator(evaluation, target))
-                    except Exception as e:
-                        true_for_this_graph = False
-                        if debug: print e
-                        if debug: print "Exception, bailing out of graph loop."
-
-                    truth.append(true_for_this_graph) 
-
-                    if true_for_this_graph:
-                        if gid not in significance or \
-                            (self.comparator in [operator.gt, operator.ge] and evaluation < significance[gid]['value']) or \
-                            (self.comparator in [operator.lt, operator.le] and evaluation > significance[gid]['value']):
-
-                            if debug: print "\t\tPossible significance"
-                            if exprid not in possible_significance:
-                                possible_significance[exprid] = {}
-                            possible_significance[exprid][gid] = {'exprid': exprid, 'expression': expr, 'value': evaluation}
-                        elif self.comparator not in [operator.gt, operator.ge, operator.lt, operator.le]:
-                            raise ValueError("Significance is not defined for this comparator.")
-
-                        if evaluation == target:
-                            if debug: print "\t\tPossible bingo"
-                            if exprid not in possible_bingos:
-                                possible_bingos[exprid] = {}
-                            possible_bingos[exprid][gid] = True
-
-                if debug: print "\tTrue for all graphs:", all(truth)
-
-                if all(truth):
-                    if exprid in possible_significance:
-                        for gid in possible_significance[exprid]:
-                            significance[gid] = possible_significance[exprid][gid]
-
-                    if debug: print "\tPossible bingos:", possible_bingos
-                        
-                    if exprid in possible_bingos:
-                        for gid in possible_bingos[exprid]:
-                            if possible_bingos[exprid][gid]:
-                                bingos[gid] = True
-                                if debug: print "\tBingo added"
-
-                # if debug: print "\tSignificant:", significance
-                # if debug: print "\tBingos:", bingos
+                if self._refutations.get(expr.key()) in present:
+                    if debug: print "\tAlready refuted."
+                    evaluations = None
+                else:
+                    evaluations = self._evaluations(expr, graphs, targets, debug)
+
+                if debug: print "\tTrue for all graphs:", evaluations is not None
+
+                if evaluations is not None:
+                    for key, evaluation in evaluations.iteritems():
+                        if key not in significance or \
+                            (self.comparator in [operator.gt, operator.ge] and evaluation < significance[key]['value']) or \
+                            (self.comparator in [operator.lt, operator.le] and evaluation > significance[key]['value']):
+
+                            if debug: print "\t\tSignificant for", key
+                            significance[key] = {'expression': expr, 'value': evaluation}
+
+                        if evaluation == targets[key]:
+                            if debug: print "\t\tBingo for", key
+                            bingos[key] = True
+
                 if debug: print
 
                 counter += 1
-                num_bingos = sum(1 for gid in bingos if bingos[gid])
+                num_bingos = sum(1 for key in bingos if bingos[key])
                 if verbose:
                     sys.stdout.write("\rSearching complexity {0}: {1}/{2} ({3:.2f}%) (Bingos: {4}/{5})".format(complexity, counter, expression_count, (float(counter)/expression_count)*100, num_bingos, len(bingos)))
                     sys.stdout.flush()
@@ -157,9 +384,12 @@ class GraphBrain(SageObject):
             complexity += 1
             if verbose: print
 
+        self._significance = significance
+
         conjectures = {}
-        for gid in significance:
-            conjectures[significance[gid]['exprid']] = significance[gid]['expression']
+        for key in significance:
+            expr = significance[key]['expression']
+            conjectures[expr.key()] = expr
 
         return conjectures.values()
 
@@ -247,6 +477,13 @@ class GraphExpression(SageObject):
     def copy(self):
         return GraphExpression(self.brain, self.rpn_stack[:])
 
+    def key(self):
+        r"""
+        Return a hashable key identifying the expression by its stack, used
+        for caching evaluations.
+        """
+        return tuple(self.rpn_stack)
+
     def operate(self, op, expr=None):
         copy = self.copy()
         if expr is not None: copy.extend(expr.rpn_stack[:])
@@ -298,7 +535,7 @@ class GraphExpression(SageObject):
         return len(self.rpn_stack)
 
     # @profile
-    def evaluate(self, g, numeric=False, use_cache=False):
+    def evaluate(self, g, numeric=False, use_cache=False, key=None):
         r"""
         Evaluate the expression for the given graph.
 
@@ -313,53 +550,56 @@ class GraphExpression(SageObject):
             sage: expr = GraphExpression(brain, [INPGraph.min_degree, sqrt])
             sage: expr.evaluate(g)
             sqrt(3)
+
+        With ``numeric=True`` the expression is evaluated in floating point::
+            sage: expr.evaluate(g, numeric=True)
+            1.7320508075688772
+
+        NOTES:
+        With ``use_cache=True``, ``key`` may be the graph's cache key (see
+        :class:`GraphCache`) to avoid recomputing it.
         """
         if use_cache:
-            gid = id(g)
-            exprid = id(self)
-
-            if gid not in self.brain._eval_cache:
-                self.brain._eval_cache[gid] = {}
+            if key is None:
+                key = self.brain._eval_cache.key(g)
+            values = self.brain._eval_cache.values(g, key)
+            value_key = (self.key(), numeric)
 
-            if exprid not in self.brain._eval_cache[gid]:
-                self.brain._eval_cache[gid][exprid] = self._evaluate(g, numeric, use_cache)
+            if value_key not in values:
+                values[value_key] = self._evaluate(g, numeric, use_cache, key)
 
-            return self.brain._eval_cache[gid][exprid]
+            return values[value_key]
 
         else:
             return self._evaluate(g, numeric, use_cache)
 
     # @profile
-    def _evaluate(self, g, numeric=False, use_cache=False):
+    def _evaluate(self, g, numeric=False, use_cache=False, key=None):
+        if use_cache:
+            invariants = self.brain._invariant_cache.values(g, key)
+
         stack = []
         for op in self.rpn_stack:
             # try:
             if op in self.brain.graph_invariants:
+                # The exact value is cached even when evaluating numerically,
+                # so that an exact fallback never recomputes the invariant.
                 if use_cache:
-                    gid = id(g)
-                    im_class = op.im_class
-                    name = op.__name__
-
-                    if gid not in self.brain._invariant_cache:
-                        self.brain._invariant_cache[gid] = {}
-
-                    if im_class not in self.brain._invariant_cache[gid]:
-                        self.brain._invariant_cache[gid][im_class] = {}
-
-                    if name not in self.brain._invariant_cache[gid][im_class]:
-                        if numeric:
-                            self.brain._invariant_cache[gid][im_class][name] = N(op(g))
-                        else:
-                            self.brain._invariant_cache[gid][im_class][name] = op(g)
-                    
-                    stack.append(self.brain._invariant_cache[gid][im_class][name])
+                    if op not in invariants:
+                        invariants[op] = op(g)
+                    value = invariants[op]
                 else:
-                    if numeric:
-                        stack.append(N(op(g)))
-                    else:
-                        stack.append(op(g))
+                    value = op(g)
+
+                if numeric:
+                    stack.append(float(value))
+                else:
+                    stack.append(value)
             elif op in self.brain.unary_operators:
-                stack.append(op(stack.pop()))
+                if numeric:
+                    stack.append(float(self.brain._float_operators.get(op, op)(stack.pop())))
+                else:
+                    stack.append(op(stack.pop()))
             elif op in self.brain.binary_commutative_operators + self.brain.binary_noncommutative_operators:
                 stack.append(op(stack.pop(), stack.pop()))
             # except (ValueError, ZeroDivisionError, sage.rings.infinity.SignError) as e:
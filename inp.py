@@ -18,17 +18,28 @@ AUTHORS:
 #                  http://www.gnu.org/licenses/
 #*****************************************************************************
 
+import atexit
 import cvxopt.base
 import cvxopt.solvers
 import datetime
+import errno
+import json
+import math
+import multiprocessing
+import numpy
+from collections import namedtuple, OrderedDict
 from functools import wraps
 from string import Template
-from itertools import imap
+from itertools import combinations, imap
 import os
+import pickle
+import Queue
+import random
 import re
 import subprocess
 import sys
 import time
+import traceback
 import warnings
 
 from sage.graphs.graph import Graph
@@ -39,6 +50,7 @@ from sage.functions.other import floor, ceil, sqrt
 from sage.functions.log import *
 from sage.numerical.mip import MixedIntegerLinearProgram
 from sage.misc.package import is_package_installed
+from distutils.spawn import find_executable
 from sage.rings.finite_rings.integer_mod import Mod
 import sage.version
 #from sage.combinat.combinat import Combinations
@@ -54,9 +66,971 @@ try:
 except ImportError:
     _INPGraph__has_progressbar = False
 
+def _popcount(x):
+    return bin(x).count('1')
+
+def _bitset_alpha(masks, subset, cache):
+    r"""
+    Return the independence number of the subgraph induced by the vertices in
+    the bitmask ``subset``, where ``masks`` are the neighborhood bitmasks
+    returned by :meth:`INPGraph._neighbor_bitsets`. The value of every
+    subproblem is stored in ``cache``, keyed by its bitmask, so that calls
+    sharing the same ``cache`` reuse each other's work.
+    """
+    if subset in cache:
+        return cache[subset]
+
+    if subset == 0:
+        return 0
+
+    # Find vertices of minimum and maximum degree in the induced subgraph.
+    min_v = max_v = None
+    min_d, max_d = sys.maxint, -1
+    rest = subset
+    while rest:
+        low = rest & -rest
+        rest ^= low
+        v = low.bit_length() - 1
+        d = _popcount(masks[v] & subset)
+        if d < min_d:
+            min_v, min_d = v, d
+        if d > max_d:
+            max_v, max_d = v, d
+
+    if min_d <= 1:
+        # Some maximum independent set contains a vertex of degree 0 or 1.
+        result = 1 + _bitset_alpha(masks, subset & ~(masks[min_v] | (1 << min_v)), cache)
+    else:
+        result = max(_bitset_alpha(masks, subset & ~(1 << max_v), cache),
+                     1 + _bitset_alpha(masks, subset & ~(masks[max_v] | (1 << max_v)), cache))
+
+    cache[subset] = result
+    return result
+
+def _bitset_is_clique(masks, subset):
+    r"""
+    Return true if the vertices in the bitmask ``subset`` are pairwise
+    adjacent, where ``masks`` are neighborhood bitmasks.
+    """
+    rest = subset
+    while rest:
+        u = rest & -rest
+        rest ^= u
+        if subset & ~masks[u.bit_length() - 1] & ~u:
+            return False
+    return True
+
+def _bitset_fold_data(masks, v):
+    r"""
+    Return a pair ``(foldable, nonedges)`` for the vertex with index ``v``,
+    where ``foldable`` is true if `N(v)` contains no anti-triangle and
+    ``nonedges`` is the number of non-adjacent pairs of vertices in `N(v)`.
+    """
+    Nv = masks[v]
+    foldable = True
+    nonedges = 0
+
+    rest = Nv
+    while rest:
+        u = rest & -rest
+        rest ^= u
+        Nu = masks[u.bit_length() - 1]
+
+        # Vertices of N(v) after u that are not adjacent to u.
+        others = rest & ~Nu
+        nonedges += _popcount(others)
+
+        while foldable and others:
+            w = others & -others
+            others ^= w
+            if Nv & ~Nu & ~masks[w.bit_length() - 1] & ~u & ~w:
+                foldable = False
+
+    return foldable, nonedges
+
+class Profiler(object):
+    r"""
+    Call statistics for the functions evaluated on graphs: the number of
+    calls, the total and percentile wall times, the number of calls that
+    raised ``ValueError``, and how often the function decided the outcome of
+    :meth:`INPGraph.is_difficult`. Profiling is off until
+    :meth:`INPGraph.enable_profiling` is called.
+
+    EXAMPLES:
+
+    ::
+        sage: profiler = INPGraph.enable_profiling()
+        sage: INPGraph.KillerGraph().is_difficult()
+        False
+        sage: profiler.stats['has_magnet']['decisive']
+        1
+        sage: INPGraph.disable_profiling()
+    """
+
+    # At most this many timings are kept per function for the percentiles.
+    _max_samples = 10000
+
+    def __init__(self):
+        self.stats = OrderedDict()
+
+    def _stats_for(self, name):
+        if name not in self.stats:
+            self.stats[name] = {'calls': 0, 'time': 0.0, 'errors': 0, 'decisive': 0, 'samples': []}
+        return self.stats[name]
+
+    def record(self, name, elapsed, error=False):
+        stats = self._stats_for(name)
+        stats['calls'] += 1
+        stats['time'] += elapsed
+        if error:
+            stats['errors'] += 1
+
+        # Keep a uniform sample of the timings.
+        samples = stats['samples']
+        if len(samples) < self._max_samples:
+            samples.append(elapsed)
+        else:
+            i = random.randrange(stats['calls'])
+            if i < self._max_samples:
+                samples[i] = elapsed
+
+    def decisive(self, name):
+        self._stats_for(name)['decisive'] += 1
+
+    def reset(self):
+        self.stats = OrderedDict()
+
+    def report(self, out=sys.stdout):
+        r"""
+        Print a table of the statistics, slowest functions first. Times are
+        in milliseconds, except for the total, which is in seconds.
+        """
+        def percentile(samples, p):
+            if not samples:
+                return 0.0
+            return 1000 * samples[min(len(samples) - 1, int(p * len(samples)))]
+
+        out.write("{0:<36} {1:>8} {2:>10} {3:>9} {4:>9} {5:>9} {6:>9} {7:>7} {8:>8}\n".format(
+            "function", "calls", "total(s)", "mean", "p50", "p90", "p99", "errors", "decisive"))
+
+        for name in sorted(self.stats, key=lambda name: -self.stats[name]['time']):
+            stats = self.stats[name]
+            samples = sorted(stats['samples'])
+            mean = 1000 * stats['time'] / stats['calls'] if stats['calls'] else 0.0
+            out.write("{0:<36} {1:>8} {2:>10.3f} {3:>9.3f} {4:>9.3f} {5:>9.3f} {6:>9.3f} {7:>7} {8:>8}\n".format(
+                name, stats['calls'], stats['time'], mean, percentile(samples, 0.5),
+                percentile(samples, 0.9), percentile(samples, 0.99), stats['errors'], stats['decisive']))
+
+def profile_graphs(func):
+    r"""
+    Decorate a function of a graph so that its calls are recorded by the
+    active :class:`Profiler`. When profiling is disabled this only adds one
+    attribute lookup per call.
+    """
+    @wraps(func)
+    def profiled(g, *args, **kwargs):
+        if INPGraph._profiler is None:
+            return func(g, *args, **kwargs)
+
+        error = False
+        start = time.time()
+        try:
+            return func(g, *args, **kwargs)
+        except ValueError:
+            error = True
+            raise
+        finally:
+            INPGraph._profiler.record(func.__name__, time.time() - start, error)
+    return profiled
+
+DossierEntry = namedtuple('DossierEntry', ['value', 'error', 'time'])
+
+class Dossier(object):
+    r"""
+    The results of evaluating the alpha properties, lower bounds and upper
+    bounds of a graph. For each function, the dossier keeps a
+    :class:`DossierEntry` with its value, the ``ValueError`` it raised (if
+    any) and the number of seconds it took. Nothing is evaluated twice, so
+    the same dossier can decide :meth:`INPGraph.is_difficult` and then be
+    rendered by :meth:`INPGraph.save_files`.
+
+    EXAMPLES:
+
+    ::
+        sage: d = INPGraph.KillerGraph().is_difficult(dossier=True)
+        sage: d.difficult
+        False
+        sage: d.alpha_properties['has_magnet'].value
+        True
+        sage: d.complete().lower_bounds['caro_wei'].value
+        5/2
+    """
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.alpha_properties = OrderedDict()
+        self.lower_bounds = OrderedDict()
+        self.upper_bounds = OrderedDict()
+        self.difficult = None
+        self._alpha = None
+
+    def evaluate(self, section, func):
+        r"""
+        Return the entry for ``func`` in the given section, evaluating the
+        function on the graph if it has not been evaluated yet.
+        """
+        name = func.__name__
+        if name not in section:
+            error = None
+            start = time.time()
+            try:
+                value = func(self.graph)
+            except ValueError as e:
+                value = None
+                error = e
+            elapsed = time.time() - start
+            section[name] = DossierEntry(value, error, elapsed)
+
+            if INPGraph._profiler is not None:
+                INPGraph._profiler.record(name, elapsed, error is not None)
+        return section[name]
+
+    def __getstate__(self):
+        # The graph is sent separately when exporting in the background.
+        state = self.__dict__.copy()
+        state['graph'] = None
+        return state
+
+    @property
+    def alpha(self):
+        if self._alpha is None:
+            self._alpha = self.graph.independence_number()
+        return self._alpha
+
+    def _alpha_property_order(self):
+        # The alpha properties that are alpha-reductions are cheap and often
+        # hold on large graphs, so they are checked first there.
+        g = self.graph
+        if g.order() < g._alpha_reduce_order:
+            return g._alpha_properties
+        first = [func for func in g._alpha_reduction_properties if func in g._alpha_properties]
+        return first + [func for func in g._alpha_properties if func not in first]
+
+    def has_alpha_property(self):
+        for func in self._alpha_property_order():
+            entry = self.evaluate(self.alpha_properties, func)
+            if entry.error is None and entry.value:
+                return True
+
+        return False
+
+    def best_lower_bound(self):
+        # The default bound is 1
+        lbound = 1
+
+        for func in self.graph._lower_bounds:
+            entry = self.evaluate(self.lower_bounds, func)
+            if entry.error is None and entry.value > lbound:
+                lbound = entry.value
+
+        return lbound
+
+    def best_upper_bound(self):
+        # The default upper bound is the number of vertices
+        ubound = self.graph.order()
+
+        for func in self.graph._upper_bounds:
+            entry = self.evaluate(self.upper_bounds, func)
+            if entry.error is None and entry.value < ubound:
+                ubound = entry.value
+
+        return ubound
+
+    def decide(self):
+        r"""
+        Determine whether the graph is difficult, evaluating only what is
+        needed, and return the answer.
+        """
+        if self.has_alpha_property():
+            self.difficult = False
+        else:
+            lbound = ceil(self.best_lower_bound())
+            ubound = floor(self.best_upper_bound())
+            self.difficult = lbound != ubound
+
+        if INPGraph._profiler is not None:
+            for name in self.decisive():
+                INPGraph._profiler.decisive(name)
+
+        return self.difficult
+
+    def decisive(self):
+        r"""
+        Return the names of the functions that decided the difficulty test:
+        the alpha property that holds, or the bounds achieving the best lower
+        and upper bounds when they meet.
+        """
+        for name, entry in self.alpha_properties.iteritems():
+            if entry.error is None and entry.value:
+                return [name]
+
+        if self.difficult is not False:
+            return []
+
+        lbound = ceil(self.best_lower_bound())
+        ubound = floor(self.best_upper_bound())
+        return [name for name, entry in self.lower_bounds.iteritems() if entry.error is None and ceil(entry.value) == lbound] + \
+               [name for name, entry in self.upper_bounds.iteritems() if entry.error is None and floor(entry.value) == ubound]
+
+    def complete(self):
+        r"""
+        Evaluate every alpha property, lower bound and upper bound that has
+        not been evaluated yet, and return the dossier.
+        """
+        for func in self.graph._alpha_properties:
+            self.evaluate(self.alpha_properties, func)
+        for func in self.graph._lower_bounds:
+            self.evaluate(self.lower_bounds, func)
+        for func in self.graph._upper_bounds:
+            self.evaluate(self.upper_bounds, func)
+
+        if self.difficult is None:
+            self.decide()
+
+        return self
+
+def _export_worker(graph6, pos, dossier):
+    try:
+        g = INPGraph(graph6)
+        if pos:
+            g.set_pos(pos)
+        if dossier is not None:
+            dossier.graph = g
+        folder_path, errors = g.save_files(dossier)
+        return (graph6, folder_path, errors)
+    except Exception:
+        return (graph6, None, [traceback.format_exc()])
+
+class ExportQueue(object):
+    r"""
+    A pool of worker processes that save the files of graphs in the
+    background, see :meth:`INPGraph.save_files`. Failed exports are printed
+    as soon as they happen and are collected in ``errors``.
+    """
+
+    def __init__(self, processes=None):
+        self._pool = multiprocessing.Pool(processes)
+        self._pending = []
+        self.folders = []
+        self.errors = []
+
+    def submit(self, g, dossier=None):
+        r"""
+        Queue the graph, and optionally its dossier, for export and return
+        immediately.
+        """
+        result = self._pool.apply_async(_export_worker, (g.graph6_string(), g.get_pos(), dossier),
+                                        callback=self._finished)
+        self._pending.append(result)
+        return result
+
+    def _finished(self, result):
+        graph6, folder_path, errors = result
+        if folder_path is not None:
+            self.folders.append(folder_path)
+        for error in errors:
+            self.errors.append((graph6, error))
+            print "Exporting {0} failed: {1}".format(graph6, error)
+
+    def wait(self):
+        r"""
+        Block until every queued export has finished.
+        """
+        for result in self._pending:
+            result.wait()
+        self._pending = []
+
+    def close(self):
+        r"""
+        Wait for the queued exports and shut down the worker processes. A
+        new queue is started by the next background export. Closing a closed
+        queue does nothing.
+        """
+        if self._pool is None:
+            return
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+        self._pending = []
+        if INPGraph._export_queue is self:
+            INPGraph._export_queue = None
+
+class SurveySink(object):
+    r"""
+    Write one record per graph checked by :meth:`INPGraph.survey` to a folder
+    of NumPy ``.npy`` chunks. Each record holds the graph6 string, the
+    independence number, the value of every bound (NaN if it raised
+    ``ValueError``) and the flag of every alpha property (-1 if it raised
+    ``ValueError``). At most ``chunk_size`` records are kept in memory; each
+    full chunk is written to its own file.
+
+    The chunks can be loaded without recomputing anything, memory-mapped by
+    default, with :meth:`load`.
+
+    EXAMPLES:
+
+    ::
+        sage: import tempfile
+        sage: folder = tempfile.mkdtemp()
+        sage: sink = SurveySink(folder, chunk_size=1)
+        sage: sink.start(6, [INPGraph.residue, INPGraph.has_magnet])
+        sage: sink.write('EFz_', 2, {'residue': 2, 'has_magnet': False})
+        sage: sink.write('E?~o', 3, {'residue': 3, 'has_magnet': None})
+        sage: sink.close()
+        sage: records = SurveySink.load(folder)
+        sage: len(records), records[1]['alpha'], records[1]['has_magnet']
+        (2, 3, -1)
+    """
+
+    def __init__(self, folder, chunk_size=65536):
+        self.folder = folder
+        self.chunk_size = chunk_size
+        self.chunks = 0
+        self._dtype = None
+        self._buffer = None
+        self._size = 0
+
+    def start(self, order, funcs):
+        r"""
+        Prepare to receive records for graphs of the given order, with a field
+        for each function in ``funcs``. The folder must not contain records
+        of an earlier survey.
+        """
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        elif self.load_chunks(self.folder):
+            raise ValueError, "{0} already contains survey records.".format(self.folder)
+
+        # A graph6 string has a header encoding the order, of one character
+        # up to 62 vertices, four up to 258047 and eight beyond, then one
+        # character for every six bits of the upper triangle of the
+        # adjacency matrix.
+        if order <= 62:
+            header = 1
+        elif order <= 258047:
+            header = 4
+        else:
+            header = 8
+        graph6_length = header + (order*(order-1)/2 + 5) / 6
+        fields = [('graph6', 'S{0}'.format(graph6_length)), ('alpha', numpy.int16)]
+        for f in funcs:
+            if INPGraph._function_kind(f) == 'alpha_property':
+                fields.append((f.__name__, numpy.int8))
+            else:
+                fields.append((f.__name__, numpy.float64))
+
+        self._dtype = numpy.dtype(fields)
+        self._buffer = numpy.zeros(self.chunk_size, dtype=self._dtype)
+        self._size = 0
+
+    def write(self, graph6, alpha, values):
+        r"""
+        Add the record of one graph. ``values`` maps the name of each function
+        to its value, or to None if it raised ``ValueError``.
+        """
+        record = self._buffer[self._size]
+        record['graph6'] = graph6
+        record['alpha'] = alpha
+        for name in self._dtype.names[2:]:
+            value = values[name]
+            if self._dtype[name] == numpy.int8:
+                record[name] = -1 if value is None else int(bool(value))
+            else:
+                record[name] = numpy.nan if value is None else float(value)
+
+        self._size += 1
+        if self._size == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        r"""
+        Write the records in memory to a new chunk file.
+        """
+        if self._size == 0:
+            return
+        numpy.save(os.path.join(self.folder, "chunk-{0:06d}.npy".format(self.chunks)), self._buffer[:self._size])
+        self.chunks += 1
+        self._size = 0
+
+    def close(self):
+        self.flush()
+
+    @classmethod
+    def load(cls, folder, mmap=True):
+        r"""
+        Return the records written to ``folder`` as a single array. If
+        ``mmap`` is True, a folder with a single chunk is memory-mapped
+        rather than read; several chunks are concatenated into memory, so
+        use :meth:`load_chunks` to keep each chunk memory-mapped.
+        """
+        chunks = cls.load_chunks(folder, mmap)
+        if len(chunks) == 1:
+            return chunks[0]
+        return numpy.concatenate(chunks)
+
+    @classmethod
+    def load_chunks(cls, folder, mmap=True):
+        r"""
+        Return the list of chunks written to ``folder``, in order, each
+        memory-mapped if ``mmap`` is True.
+        """
+        names = sorted(name for name in os.listdir(folder) if name.startswith("chunk-") and name.endswith(".npy"))
+        return [numpy.load(os.path.join(folder, name), mmap_mode='r' if mmap else None) for name in names]
+
+def _graph6_bitsets(graph6):
+    # Decode a graph6 string of a graph with at most 62 vertices into the
+    # list of neighbor bitmasks of its vertices.
+    n = ord(graph6[0]) - 63
+    bits = []
+    for c in graph6[1:]:
+        x = ord(c) - 63
+        bits.extend((x >> k) & 1 for k in range(5, -1, -1))
+
+    masks = [0] * n
+    k = 0
+    for j in range(1, n):
+        for i in range(j):
+            if bits[k]:
+                masks[i] |= 1 << j
+                masks[j] |= 1 << i
+            k += 1
+    return masks
+
+class GraphCorpus(object):
+    r"""
+    The graphs generated by ``nauty-geng`` with the given arguments and
+    order, stored once in a binary file and read back through ``mmap``. Each
+    graph is a fixed-width row of ``order`` unsigned 64-bit neighbor
+    bitmasks, so any graph can be read by its index in constant time, and
+    processes reading the same corpus share its pages. A JSON index next to
+    the file records the order, the ``geng`` arguments and the number of
+    graphs. Only graphs with at most 62 vertices, whose graph6 strings have
+    a one-byte header, can be stored.
+
+    Use :meth:`INPGraph.corpus` to get the corpus of an order, generating it
+    on first use.
+
+    EXAMPLES:
+
+    ::
+        sage: corpus = INPGraph.corpus(6)
+        sage: len(corpus)
+        8
+        sage: corpus[0].order()
+        6
+        sage: [g.graph6_string() for g in corpus] == [g.graph6_string() for g in graphs.nauty_geng("-cd3D4 6")]
+        True
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + ".json") as f:
+            index = json.load(f)
+        self.order = index['order']
+        self.geng_args = index['geng_args']
+        self._count = index['count']
+
+        if self._count == 0:
+            self.rows = numpy.zeros((0, self.order), dtype=numpy.uint64)
+        else:
+            self.rows = numpy.memmap(path, dtype=numpy.uint64, mode='r', shape=(self._count, self.order))
+
+    @classmethod
+    def geng(cls, order, geng_args, path=None, shard=None):
+        r"""
+        Run ``nauty-geng`` with the given arguments and order, and yield the
+        graph6 string of each graph as soon as it is generated. If ``path`` is
+        given, the graphs are also written to a corpus there as they arrive.
+        If ``shard`` is a pair ``(res, mod)``, only the graphs of that
+        ``nauty-geng res/mod`` shard are generated.
+
+        The corpus file is written to a temporary name first and only kept
+        if every graph was read. If the caller stops early, ``nauty-geng`` is
+        killed and the temporary file is removed. The number of graphs of a
+        complete run of every shard is saved with
+        :meth:`INPGraph._record_count`.
+        """
+        if path is not None and shard is not None:
+            raise ValueError, "A corpus holds every graph, not a shard."
+        if path is not None and order > 62:
+            raise ValueError, "A corpus can only hold graphs with at most 62 vertices."
+
+        f = None
+        if path is not None:
+            folder = os.path.dirname(path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+            f = open(tmp_path, 'wb')
+
+        args = ["{0}/local/bin/nauty-geng".format(SAGE_ROOT), "-q"] + geng_args.split() + [str(order)]
+        if shard is not None:
+            args.append("{0}/{1}".format(*shard))
+        geng = subprocess.Popen(args, stdout=subprocess.PIPE)
+        count = 0
+        complete = False
+        try:
+            for line in iter(geng.stdout.readline, ''):
+                line = line.strip()
+                if not line:
+                    continue
+                if f is not None:
+                    numpy.array(_graph6_bitsets(line), dtype=numpy.uint64).tofile(f)
+                count += 1
+                yield line
+
+            if geng.wait() != 0:
+                raise RuntimeError, "nauty-geng failed."
+            complete = True
+        finally:
+            if geng.poll() is None:
+                geng.kill()
+                geng.wait()
+
+            if f is not None:
+                f.close()
+                if complete:
+                    with open(path + ".json", 'w') as index:
+                        json.dump({'order': order, 'geng_args': geng_args, 'count': count}, index)
+                    os.rename(tmp_path, path)
+                else:
+                    os.remove(tmp_path)
+
+        if shard is None:
+            INPGraph._record_count(order, geng_args, count)
+
+    @classmethod
+    def generate(cls, path, order, geng_args):
+        r"""
+        Run ``nauty-geng`` with the given arguments and order, write the
+        generated graphs to ``path`` and return the corpus. An interrupted
+        run leaves no corpus behind, see :meth:`geng`.
+        """
+        for graph6 in cls.geng(order, geng_args, path):
+            pass
+        return cls(path)
+
+    def __len__(self):
+        return self._count
+
+    def bitsets(self, i):
+        r"""
+        Return the list of neighbor bitmasks of the ``i``-th graph.
+        """
+        return [int(x) for x in self.rows[i]]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError, "corpus index out of range"
+
+        masks = self.bitsets(i)
+        return INPGraph(dict((v, [w for w in range(self.order) if masks[v] >> w & 1]) for v in range(self.order)))
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            yield self[i]
+
+class ProgressMeter(object):
+    r"""
+    Progress of a search over ``total`` graphs. The display (a progress bar if
+    ``python-progressbar`` is installed) is refreshed at most
+    ``_updates_per_second`` times per second, however often :meth:`update` is
+    called, and shows the number of graphs checked per second and the
+    estimated time remaining. Graphs rejected by a stage of the search are
+    counted per stage with :meth:`reject`.
+
+    If ``metrics_path`` is given, each refresh also appends a JSON line with
+    the same numbers to that file.
+
+    EXAMPLES:
+
+    ::
+        sage: meter = ProgressMeter(3, "Testing", display=False)
+        sage: for i in range(3):
+        ....:     meter.reject("has_magnet")
+        ....:     meter.update()
+        sage: meter.finish()
+        sage: meter.count, meter.rejections['has_magnet']
+        (3, 3)
+    """
+
+    _updates_per_second = 4
+
+    def __init__(self, total, label, display=True, metrics_path=None):
+        self.total = total
+        self.label = label
+        self.display = display
+        self.metrics_path = metrics_path
+        self.count = 0
+        self.rejections = OrderedDict()
+        self._start = time.time()
+        self._next_emit = self._start
+
+        self._pbar = None
+        if display and _INPGraph__has_progressbar:
+            self._pbar = ProgressBar(widgets=[label + ": ", Counter(), Bar(), ETA()], maxval=max(total, 1), fd=sys.stdout).start()
+
+    def update(self, count=1):
+        self.count += count
+        now = time.time()
+        if now >= self._next_emit:
+            self._next_emit = now + 1.0 / self._updates_per_second
+            self.emit(now)
+
+    def reject(self, stage):
+        self.rejections[stage] = self.rejections.get(stage, 0) + 1
+
+    def rate(self, now=None):
+        r"""
+        Return the number of graphs checked per second so far.
+        """
+        if now is None:
+            now = time.time()
+        elapsed = now - self._start
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def eta(self, now=None):
+        r"""
+        Return the estimated number of seconds until all graphs are checked,
+        or None if it can't be estimated yet.
+        """
+        rate = self.rate(now)
+        if rate == 0 or self.total is None:
+            return None
+        return max(self.total - self.count, 0) / rate
+
+    def emit(self, now=None):
+        if now is None:
+            now = time.time()
+
+        if self.display:
+            if self._pbar is not None:
+                self._pbar.update(min(self.count, self._pbar.maxval))
+            else:
+                eta = self.eta(now)
+                sys.stdout.write("{0}: {1}/{2} ({3:.2f}%), {4:.0f} graphs/s, ETA {5}\r".format(
+                    self.label, self.count, self.total, 100.0 * self.count / max(self.total, 1), self.rate(now),
+                    "?" if eta is None else datetime.timedelta(seconds=int(eta))))
+            sys.stdout.flush()
+
+        if self.metrics_path is not None:
+            with open(self.metrics_path, 'a') as f:
+                f.write(json.dumps(OrderedDict([('time', now), ('label', self.label), ('count', self.count),
+                                                ('total', self.total), ('rate', self.rate(now)), ('eta', self.eta(now)),
+                                                ('rejections', self.rejections)])) + "\n")
+
+    def finish(self):
+        self.emit()
+        if self.display:
+            if self._pbar is not None:
+                self._pbar.finish()
+            else:
+                print
+
+class GraphDeduplicator(object):
+    r"""
+    Remembers graphs up to isomorphism, so that duplicates can be dropped
+    from a stream of graphs with :meth:`add` or :meth:`filter`.
+
+    Graphs are bucketed by their order, size and degree sequence. The
+    characteristic polynomial of a graph is only computed once another
+    graph shares its bucket, and a canonical labeling only once another
+    graph also shares its characteristic polynomial, so the expensive steps
+    only run on real collisions.
+
+    EXAMPLES:
+
+    ::
+        sage: seen = GraphDeduplicator([INPGraph.SkewStar()])
+        sage: seen.add(INPGraph.SuperClaw(1, 2, 3)), seen.add(INPGraph.SuperClaw(1, 1, 4))
+        (False, True)
+    """
+
+    def __init__(self, graphs=[]):
+        # Each bucket is [graph, None] until a second graph arrives, and then
+        # [None, {charpoly: entry}], where each entry is [graph, None] until a
+        # second graph arrives, and then [None, set of canonical graph6].
+        self._buckets = {}
+        for g in graphs:
+            self.add(g)
+
+    def add(self, g):
+        r"""
+        Remember the graph, and return True if it is not isomorphic to any
+        graph remembered before.
+        """
+        key = (g.order(), g.size(), tuple(sorted(g.degree())))
+        if key not in self._buckets:
+            self._buckets[key] = [g, None]
+            return True
+
+        bucket = self._buckets[key]
+        if bucket[1] is None:
+            bucket[1] = {}
+            self._add_to(bucket[1], bucket[0].adjacency_matrix().charpoly(), bucket[0])
+            bucket[0] = None
+        return self._add_to(bucket[1], g.adjacency_matrix().charpoly(), g)
+
+    def _add_to(self, entries, charpoly, g):
+        if charpoly not in entries:
+            entries[charpoly] = [g, None]
+            return True
+
+        entry = entries[charpoly]
+        if entry[1] is None:
+            entry[1] = set([entry[0].canonical_label().graph6_string()])
+            entry[0] = None
+
+        canonical = g.canonical_label().graph6_string()
+        if canonical in entry[1]:
+            return False
+        entry[1].add(canonical)
+        return True
+
+    def filter(self, graphs):
+        r"""
+        Return the graphs that are not isomorphic to a graph remembered
+        before or to an earlier graph in ``graphs``, remembering them.
+        """
+        return [g for g in graphs if self.add(g)]
+
+def unique_graphs(graphs, known=[]):
+    r"""
+    Return the graphs that are not isomorphic to an earlier graph or to a
+    graph in ``known``, in their original order. See
+    :class:`GraphDeduplicator`.
+
+    EXAMPLES:
+
+    ::
+        sage: p = INPGraph(graphs.PetersenGraph())
+        sage: q = p.copy()
+        sage: q.relabel(range(9, -1, -1))
+        sage: len(unique_graphs([p, INPGraph.KillerGraph(), q]))
+        2
+        sage: unique_graphs([q], known=[p])
+        []
+    """
+    return GraphDeduplicator(known).filter(graphs)
+
+def _find_example_worker(corpus, func, prefilter, next_chunk, best, chunk_size, errors):
+    # Check chunks of the corpus in increasing order until a witness is
+    # found at a lower index than any chunk still to be checked. A graph on
+    # which func or prefilter raises counts as a witness, and the exception
+    # is sent to the parent, which raises it if no earlier witness is found.
+    while True:
+        with next_chunk.get_lock():
+            start = next_chunk.value
+            next_chunk.value += chunk_size
+
+        if start >= min(len(corpus), best.value):
+            return
+
+        for i in xrange(start, min(start + chunk_size, len(corpus))):
+            if i >= best.value:
+                return
+
+            try:
+                g = corpus[i]
+                found = (prefilter is None or prefilter(g)) and func(g)
+            except Exception as e:
+                try:
+                    pickle.dumps(e)
+                except Exception:
+                    e = None
+                errors.put((i, e, traceback.format_exc()))
+                found = True
+
+            if found:
+                with best.get_lock():
+                    if i < best.value:
+                        best.value = i
+                return
+
+def _find_example_shard_worker(order, geng_args, mod, func, prefilter, next_shard, best, checked, chunk_size, found):
+    # Stream the nauty-geng res/mod shards in increasing order until a
+    # witness is found in a lower shard than any shard still to be checked.
+    # best holds the (shard, index) of the first witness found so far, and
+    # every witness is sent to the parent with its graph6 string. A graph on
+    # which func or prefilter raises counts as a witness, as above.
+    while True:
+        with next_shard.get_lock():
+            shard = next_shard.value
+            next_shard.value += 1
+
+        if shard >= best[0]:
+            return
+
+        gen = GraphCorpus.geng(order, geng_args, shard=(shard, mod))
+        unreported = 0
+        try:
+            for i, graph6 in enumerate(gen):
+                if shard > best[0]:
+                    return
+
+                try:
+                    g = INPGraph(graph6)
+                    result = (prefilter is None or prefilter(g)) and func(g)
+                    error = None
+                except Exception as e:
+                    try:
+                        pickle.dumps(e)
+                    except Exception:
+                        e = None
+                    result = True
+                    error = (e, traceback.format_exc())
+
+                if result:
+                    found.put(((shard, i), graph6, error))
+                    with best.get_lock():
+                        if (shard, i) < (best[0], best[1]):
+                            best[0], best[1] = shard, i
+                    return
+
+                unreported += 1
+                if unreported == chunk_size:
+                    with checked.get_lock():
+                        checked.value += unreported
+                    unreported = 0
+        finally:
+            gen.close()
+            with checked.get_lock():
+                checked.value += unreported
+
 class INPGraph(Graph):
     _nauty_count_pattern = re.compile(r'>Z (\d+) graphs generated')
     _save_path = os.path.expanduser("~/Dropbox/INP")
+    _theta_stable_group_limit = 48
+    _alpha_reduce_order = 30
+    _export_queue = None
+    _pdflatex_path = None
+    _profiler = None
+    _corpus_path = os.path.expanduser("~/.inp/corpora")
+    # Save the graphs streamed by a complete search as a corpus.
+    _save_corpora = False
+    # Searches append their progress metrics to this file if it is set.
+    _metrics_path = None
+    _find_example_chunk_size = 256
+    # Without a corpus, parallel searches split each order into this many
+    # nauty-geng res/mod shards.
+    _find_example_shards = 64
+    _count_table_path = os.path.expanduser("~/.inp/counts.json")
+    # Unknown counts are estimated from _count_shard_samples of the
+    # _count_shard_mod shards of nauty-geng res/mod.
+    _count_shard_mod = 256
+    _count_shard_samples = 4
 
     def memoize_graphs(func):
         func._cache = {}
@@ -68,12 +1042,219 @@ class INPGraph(Graph):
             return func._cache[key]
         return memo
 
+    def invalidates_context(func):
+        @wraps(func)
+        def mutator(self, *args, **kwargs):
+            self.invalidate_context()
+            return func(self, *args, **kwargs)
+        return mutator
+
     def __init__(self, *args, **kwargs):
         Graph.__init__(self, *args, **kwargs)
 
+    # Mutating the graph discards the shared values in its context.
+    add_vertex = invalidates_context(Graph.add_vertex)
+    add_vertices = invalidates_context(Graph.add_vertices)
+    delete_vertex = invalidates_context(Graph.delete_vertex)
+    delete_vertices = invalidates_context(Graph.delete_vertices)
+    add_edge = invalidates_context(Graph.add_edge)
+    add_edges = invalidates_context(Graph.add_edges)
+    delete_edge = invalidates_context(Graph.delete_edge)
+    delete_edges = invalidates_context(Graph.delete_edges)
+    add_path = invalidates_context(Graph.add_path)
+    add_cycle = invalidates_context(Graph.add_cycle)
+    merge_vertices = invalidates_context(Graph.merge_vertices)
+    subdivide_edge = invalidates_context(Graph.subdivide_edge)
+    relabel = invalidates_context(Graph.relabel)
+
     @classmethod
-    def survey(cls, func, order):
-        # TODO: Write documentation
+    def enable_profiling(cls):
+        r"""
+        Start recording call statistics for the alpha properties and bounds
+        evaluated by :meth:`is_difficult`, and for functions decorated with
+        ``profile_graphs``, and return the :class:`Profiler`. A report is
+        printed at the end of :meth:`survey` and :meth:`next_difficult_graph`.
+        """
+        if INPGraph._profiler is None:
+            INPGraph._profiler = Profiler()
+        return INPGraph._profiler
+
+    @classmethod
+    def disable_profiling(cls):
+        INPGraph._profiler = None
+
+    @classmethod
+    def _report_profile(cls):
+        if cls._profiler is not None:
+            print
+            cls._profiler.report()
+
+    def context(self, name):
+        r"""
+        Return the value of the primitive ``name`` for the graph, computing it
+        the first time it is needed and sharing it between all bounds and
+        properties afterwards. The available primitives are the keys of
+        ``_context_primitives``.
+
+        The shared values are discarded when the graph is mutated through
+        its own methods. Call :meth:`invalidate_context` after changing the
+        graph in any other way.
+
+        EXAMPLES:
+
+        ::
+            sage: g = INPGraph(graphs.PathGraph(3))
+            sage: g.context('degree')
+            [1, 2, 1]
+            sage: g.add_edge(0, 2)
+            sage: g.context('degree')
+            [2, 2, 2]
+        """
+        values = self.__dict__.setdefault('_context', {})
+        if name not in values:
+            values[name] = self._context_primitives[name](self)
+        return values[name]
+
+    def invalidate_context(self):
+        r"""
+        Discard the values shared through :meth:`context`.
+        """
+        self.__dict__.pop('_context', None)
+
+    def set_family(self, family, **invariants):
+        r"""
+        Tag the graph as a member of the named family, with known values of
+        its invariants. The values are used by :meth:`independence_number`,
+        :meth:`lovasz_theta` and the ``spectrum`` primitive of
+        :meth:`context` instead of computing them. Like the rest of the
+        context, the tag is discarded when the graph is mutated.
+
+        EXAMPLES:
+
+        ::
+            sage: g = INPGraph.SkewStar()
+            sage: g.family(), g.family_invariant('independence_number')
+            ('superclaw', 4)
+            sage: g.add_edge(1, 6)
+            sage: g.family() is None
+            True
+        """
+        values = self.__dict__.setdefault('_context', {})
+        values['family'] = family
+        values['family_invariants'] = invariants
+
+    def family(self):
+        r"""
+        Return the name of the family the graph was tagged with by its
+        constructor, or None. Cycles, complete graphs and the Petersen graph
+        built by Sage's generators are recognized by their name, once their
+        structure is verified.
+
+        EXAMPLES:
+
+        ::
+            sage: INPGraph(graphs.CycleGraph(7)).family()
+            'cycle'
+            sage: INPGraph(graphs.PetersenGraph()).family_invariant('lovasz_theta')
+            4.0
+            sage: INPGraph(graphs.PathGraph(3)).family() is None
+            True
+        """
+        values = self.__dict__.setdefault('_context', {})
+        if 'family' not in values:
+            self._detect_family()
+            values.setdefault('family', None)
+        return values['family']
+
+    def family_invariant(self, name):
+        r"""
+        Return the known value of the invariant ``name`` for the graph's
+        family, or None if it is not known.
+        """
+        if self.family() is None:
+            return None
+        return self._context['family_invariants'].get(name)
+
+    def _detect_family(self):
+        name = self.name()
+        n = self.order()
+        if self.has_loops() or self.has_multiple_edges() or n == 0:
+            return
+
+        if name.startswith("Cycle graph") and n >= 3 and self.is_regular(2) and self.is_connected():
+            if n % 2 == 0:
+                theta = n / 2.0
+            else:
+                theta = n * math.cos(math.pi / n) / (1 + math.cos(math.pi / n))
+            self.set_family("cycle", independence_number=n / 2, lovasz_theta=theta)
+
+        elif name.startswith("Complete graph") and self.size() == n * (n - 1) / 2:
+            self.set_family("complete", independence_number=1, lovasz_theta=1.0,
+                            spectrum=[Integer(n-1)] + [Integer(-1)]*(n-1))
+
+        elif name == "Petersen graph" and self.is_isomorphic(graphs.PetersenGraph()):
+            self.set_family("petersen", independence_number=4, lovasz_theta=4.0,
+                            spectrum=[Integer(3)] + [Integer(1)]*5 + [Integer(-2)]*4)
+
+    @classmethod
+    def _function_kind(cls, func):
+        r"""
+        Return ``'alpha_property'``, ``'lower_bound'`` or ``'upper_bound'``
+        according to the flag set on ``func`` or the list of
+        ``_alpha_properties``, ``_lower_bounds`` or ``_upper_bounds`` it is
+        in, or None if it is none of these.
+
+        EXAMPLES:
+
+        ::
+            sage: INPGraph._function_kind(INPGraph.residue)
+            'lower_bound'
+            sage: INPGraph._function_kind(Graph.is_perfect)
+            'alpha_property'
+            sage: INPGraph._function_kind(Graph.order) is None
+            True
+        """
+        # Compare the underlying functions, as INPGraph.residue is a method
+        # wrapping the function stored in _lower_bounds.
+        f = getattr(func, 'im_func', func)
+        for kind, attr, funcs in [('alpha_property', '_is_alpha_property', cls._alpha_properties),
+                                  ('lower_bound', '_is_lower_bound', cls._lower_bounds),
+                                  ('upper_bound', '_is_upper_bound', cls._upper_bounds)]:
+            if getattr(func, attr, False) or f in [getattr(h, 'im_func', h) for h in funcs]:
+                return kind
+        return None
+
+    @classmethod
+    def survey(cls, func, order, tightness=False, sink=None):
+        r"""
+        Check bounds or alpha properties against all graphs of the given order
+        that are searched for difficult graphs.
+
+        INPUT:
+
+        - ``func`` - function or list of functions -- The bounds and alpha
+          properties to check. All of them are evaluated in a single pass over
+          the graphs, and the independence number of each graph is only
+          computed once.
+
+        - ``order`` - int -- The order of the graphs to check.
+
+        - ``tightness`` - boolean -- Also record the value of every function
+          on every graph.
+
+        - ``sink`` - string or SurveySink -- Stream the record of every graph
+          to this folder instead of keeping them in memory (see
+          :class:`SurveySink`).
+
+        OUTPUT:
+
+        A dictionary mapping the name of each function to the number of
+        graphs it predicted (for bounds) or that satisfied it (for alpha
+        properties). If ``tightness`` is True, a list of
+        ``(graph6, alpha, values)`` tuples is returned as well, where
+        ``values`` maps the name of each function to its value on the graph,
+        or to None if it raised ``ValueError``.
+        """
         # TODO: Is it possible to write tests for this?
         if not is_package_installed("nauty"):
             raise TypeError, "The nauty package is required to survey a bound or property."
@@ -82,80 +1263,256 @@ class INPGraph(Graph):
         if order < 6:
             raise ValueError, "There are no difficult graphs with less than 6 vertices."
 
-        sys.stdout.write("Counting graphs of order {0}... ".format(order))
-        sys.stdout.flush()
-        num_graphs_to_check = cls.count_viable_graphs(order)
-        print num_graphs_to_check
+        if isinstance(func, (list, tuple)):
+            funcs = list(func)
+        else:
+            funcs = [func]
 
-        if __has_progressbar:
-            pbar = ProgressBar(widgets=["Testing: ", Counter(), Bar(), ETA()], maxval=num_graphs_to_check, fd=sys.stdout).start()
-        
-        gen = graphs.nauty_geng("-cd3D{0} {1}".format(order-2, order))
-        counter = 0
-        hits = 0
+        kinds = {}
+        for f in funcs:
+            kinds[f.__name__] = cls._function_kind(f)
+            if kinds[f.__name__] is None:
+                raise ValueError, "{0} is not a bound or alpha property.".format(f.__name__)
 
-        is_alpha_property = hasattr(func, '_is_alpha_property') and func._is_alpha_property
-        is_lower_bound = hasattr(func, '_is_lower_bound') and func._is_lower_bound
-        is_upper_bound = hasattr(func, '_is_upper_bound') and func._is_upper_bound
+        if isinstance(sink, basestring):
+            sink = SurveySink(sink)
+        if sink is not None:
+            sink.start(order, funcs)
 
-        while True:
-            try:
-                g = INPGraph(gen.next())
+        gen, num_graphs_to_check, exact = cls._search_graphs(order)
+        print "Testing {0}{1} graphs of order {2}.".format("" if exact else "about ", num_graphs_to_check, order)
+        meter = ProgressMeter(num_graphs_to_check, "Testing order {0}".format(order), metrics_path=cls._metrics_path)
+
+        counter = 0
+        hits = OrderedDict((f.__name__, 0) for f in funcs)
+        values = []
+        profiled = [(f, profile_graphs(f)) for f in funcs]
 
+        try:
+            while True:
                 try:
-                    if is_alpha_property:
-                        if func(g):
-                            hits += 1
-                    elif is_lower_bound:
-                        if ceil(func(g)) == g.independence_number():
-                            hits += 1
-                    elif is_upper_bound:
-                        if floor(func(g)) == g.independence_number():
-                            hits += 1
-
-                except ValueError:
-                    pass
+                    g = gen.next()
+                    alpha = None
+                    graph_values = OrderedDict()
+
+                    for f, pf in profiled:
+                        try:
+                            value = pf(g)
+                        except ValueError:
+                            graph_values[f.__name__] = None
+                            meter.reject(f.__name__)
+                            continue
+
+                        graph_values[f.__name__] = value
+                        if kinds[f.__name__] == 'alpha_property':
+                            hit = value
+                        else:
+                            if alpha is None:
+                                alpha = g.independence_number()
+                            if kinds[f.__name__] == 'lower_bound':
+                                hit = ceil(value) == alpha
+                            else:
+                                hit = floor(value) == alpha
+
+                        if hit:
+                            hits[f.__name__] += 1
+                        else:
+                            meter.reject(f.__name__)
+
+                    if tightness or sink is not None:
+                        if alpha is None:
+                            alpha = g.independence_number()
+                        if tightness:
+                            values.append((g.graph6_string(), alpha, graph_values))
+                        if sink is not None:
+                            sink.write(g.graph6_string(), alpha, graph_values)
+
+                    counter += 1
+                    meter.update()
+
+                except StopIteration:
+                    meter.finish()
+
+                    for f in funcs:
+                        if kinds[f.__name__] == 'alpha_property':
+                            print "{0} out of {1} graphs of order {2} satisfied {3}.".format(hits[f.__name__], counter, order, f.__name__)
+                        else:
+                            print "{0} out of {1} graphs of order {2} were predicted by {3}.".format(hits[f.__name__], counter, order, f.__name__)
+                    break
+
+                except KeyboardInterrupt:
+                    print "\nStopped."
+                    break
+        finally:
+            gen.close()
+            # Keep the buffered records even if a function raised.
+            if sink is not None:
+                sink.close()
+
+        cls._report_profile()
+        if tightness:
+            return hits, values
+        return hits
 
-                counter += 1
+    @classmethod
+    def corpus(cls, order, geng_args=None, verbose=False):
+        r"""
+        Return the :class:`GraphCorpus` of the graphs generated by
+        ``nauty-geng`` with the given arguments and order, generating and
+        saving it under ``_corpus_path`` the first time it is needed. By
+        default these are the graphs that are searched for difficult graphs.
+        If ``verbose`` is True, the number of graphs about to be generated is
+        printed, estimated by :meth:`count_graphs` if it is not known.
 
-                if __has_progressbar:
-                    pbar.update(counter)
-                else:
-                    sys.stdout.write("Testing order {0}: {1}/{2} ({3:.2f}%)\r".format(order, counter, num_graphs_to_check, (float(counter)/num_graphs_to_check)*100))    
-                sys.stdout.flush()
+        EXAMPLES:
 
-            except StopIteration:
-                if __has_progressbar:
-                    pbar.finish()
+        ::
+            sage: len(INPGraph.corpus(5, "-c"))
+            21
+        """
+        if geng_args is None:
+            geng_args = "-cd3D{0}".format(order-2)
 
-                if is_alpha_property:
-                    print "{0} out of {1} graphs of order {2} satisfied {3}.".format(hits, counter, order, func.__name__)
-                elif is_lower_bound or is_upper_bound:
-                    print "{0} out of {1} graphs of order {2} were predicted by {3}.".format(hits, counter, order, func.__name__)
-                return
+        path = cls._corpus_file(order, geng_args)
+        if os.path.exists(path):
+            return GraphCorpus(path)
 
-            except KeyboardInterrupt:
-                print "\nStopped."
-                return
+        if not is_package_installed("nauty"):
+            raise TypeError, "The nauty package is required to generate a graph corpus."
+
+        if verbose:
+            count, exact = cls.count_graphs(order, geng_args)
+            print "Generating {0}{1} graphs of order {2}...".format("" if exact else "about ", count, order)
+
+        return GraphCorpus.generate(path, order, geng_args)
 
     @classmethod
-    def count_viable_graphs(cls, order):
-        # TODO: Write documentation
-        # TODO: Write tests
-        if not is_package_installed("nauty"): 
-            raise TypeError, "The nauty package is required to count viable graphs."
+    def _search_graphs(cls, order, geng_args=None):
+        r"""
+        Return a generator of the graphs generated by ``nauty-geng`` with the
+        given arguments and order, together with their number and whether
+        that number is exact (see :meth:`count_graphs`).
+
+        The graphs are read from their :class:`GraphCorpus` if it exists.
+        Otherwise they are streamed from ``nauty-geng`` as they are generated,
+        so a search that stops early never enumerates the whole order; if
+        ``_save_corpora`` is set, they are also saved as a corpus when every
+        graph is read.
+        """
+        if geng_args is None:
+            geng_args = "-cd3D{0}".format(order-2)
+
+        path = cls._corpus_file(order, geng_args)
+        if os.path.exists(path):
+            corpus = GraphCorpus(path)
+            return iter(corpus), len(corpus), True
+
+        if not is_package_installed("nauty"):
+            raise TypeError, "The nauty package is required to generate graphs."
+
+        count, exact = cls.count_graphs(order, geng_args)
+        graph6s = GraphCorpus.geng(order, geng_args, path if cls._save_corpora else None)
+        return (INPGraph(graph6) for graph6 in graph6s), count, exact
+
+    @classmethod
+    def _corpus_file(cls, order, geng_args):
+        return os.path.join(cls._corpus_path, "geng{0}-{1}.bin".format(geng_args.replace(" ", ""), order))
+
+    @classmethod
+    def _count_table(cls):
+        if not os.path.exists(cls._count_table_path):
+            return {}
+        with open(cls._count_table_path) as f:
+            return json.load(f)
+
+    @classmethod
+    def _record_count(cls, order, geng_args, count):
+        r"""
+        Save the exact number of graphs ``nauty-geng`` generates with the
+        given arguments and order in the persistent count table.
+        """
+        table = cls._count_table()
+        table["{0} {1}".format(geng_args, order)] = count
+
+        folder = os.path.dirname(cls._count_table_path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp_path = "{0}.{1}.tmp".format(cls._count_table_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(table, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, cls._count_table_path)
+
+    @classmethod
+    def _geng_count(cls, order, geng_args, shard=None):
+        args = ["{0}/local/bin/nauty-geng".format(SAGE_ROOT), "-u"] + geng_args.split() + [str(order)]
+        if shard is not None:
+            args.append("{0}/{1}".format(*shard))
+        output = subprocess.check_output(args, stderr=subprocess.STDOUT)
+        return int(cls._nauty_count_pattern.search(output).group(1))
+
+    @classmethod
+    def count_graphs(cls, order, geng_args=None, exact=False):
+        r"""
+        Return the number of graphs ``nauty-geng`` generates with the given
+        arguments and order (by default, the graphs searched for difficult
+        graphs), and whether that number is exact.
+
+        Counts are looked up in the persistent table at ``_count_table_path``
+        and in the index of an existing :class:`GraphCorpus`. Otherwise the
+        count is estimated from ``_count_shard_samples`` of the
+        ``_count_shard_mod`` shards that ``nauty-geng res/mod`` splits the
+        graphs into, so no full enumeration is run, unless ``exact`` is True.
+        Exact counts are saved to the table.
+
+        EXAMPLES:
+
+        ::
+            sage: INPGraph.count_graphs(5, "-c", exact=True)
+            (21, True)
+            sage: INPGraph.count_graphs(5, "-c")
+            (21, True)
+        """
+        if geng_args is None:
+            geng_args = "-cd3D{0}".format(order-2)
+
+        key = "{0} {1}".format(geng_args, order)
+        table = cls._count_table()
+        if key in table:
+            return table[key], True
+
+        corpus_path = cls._corpus_file(order, geng_args)
+        if os.path.exists(corpus_path):
+            count = len(GraphCorpus(corpus_path))
+            cls._record_count(order, geng_args, count)
+            return count, True
+
+        if not is_package_installed("nauty"):
+            raise TypeError, "The nauty package is required to count graphs."
+
+        if exact:
+            count = cls._geng_count(order, geng_args)
+            cls._record_count(order, geng_args, count)
+            return count, True
+
+        mod = cls._count_shard_mod
+        step = mod / cls._count_shard_samples
+        sampled = sum(cls._geng_count(order, geng_args, (res, mod)) for res in range(0, mod, step))
+        return int(round(float(sampled) * mod / len(range(0, mod, step)))), False
 
+    @classmethod
+    def count_viable_graphs(cls, order):
+        r"""
+        Return the exact number of graphs of the given order that are searched
+        for difficult graphs. See :meth:`count_graphs`.
+        """
         # Graphs with < 6 vertices will have pendant or foldable vertices.
         if order < 6:
             return 0
 
-        output = subprocess.check_output(["{0}/local/bin/nauty-geng".format(SAGE_ROOT),
-                                 "-cud3D{0}".format(order-2), str(order)], stderr=subprocess.STDOUT)
-        m = cls._nauty_count_pattern.search(output)
-        return int(m.group(1))
+        return cls.count_graphs(order, exact=True)[0]
 
     @classmethod
-    def _next_difficult_graph_of_order(cls, order, verbose=True, save=False):
+    def _next_difficult_graph_of_order(cls, order, verbose=True, save=False, background=False):
         if not is_package_installed("nauty"): 
             raise TypeError, "The nauty package is required to find difficult graphs."
 
@@ -163,55 +1520,50 @@ class INPGraph(Graph):
         if order < 6:
             raise ValueError, "There are no difficult graphs with less than 6 vertices."
 
-        if verbose:
-            sys.stdout.write("Counting graphs of order {0}... ".format(order))
-            sys.stdout.flush()
-            num_graphs_to_check = cls.count_viable_graphs(order)
-            print num_graphs_to_check
+        gen, num_graphs_to_check, exact = cls._search_graphs(order)
 
-            if __has_progressbar:
-                pbar = ProgressBar(widgets=["Testing: ", Counter(), Bar(), ETA()], maxval=num_graphs_to_check, fd=sys.stdout).start()
+        if verbose:
+            print "Testing {0}{1} graphs of order {2}.".format("" if exact else "about ", num_graphs_to_check, order)
+        meter = ProgressMeter(num_graphs_to_check, "Testing order {0}".format(order), verbose, cls._metrics_path)
 
-        gen = graphs.nauty_geng("-cd3D{0} {1}".format(order-2, order))
         counter = 0
 
         while True:
             try:
-                g = INPGraph(gen.next())
+                g = gen.next()
                 
-                if g.is_difficult():
+                dossier = g.is_difficult(dossier=True)
+                if dossier.difficult:
+                    gen.close()
+                    meter.finish()
                     if verbose:
-                        if __has_progressbar:
-                            pbar.finish()
                         print "Found a difficult graph: {0} (Checked {1}/{2} graphs of order {3}.)".format(g.graph6_string(), counter, num_graphs_to_check, order)
 
                     if save:
-                        g.save_files()
+                        g.save_files(dossier, background)
 
                     return g
 
-                counter += 1
+                # Count the rejection against the alpha property that holds,
+                # or against the bounds if they meet.
+                decisive = dossier.decisive()
+                if decisive and decisive[0] in dossier.alpha_properties:
+                    meter.reject(decisive[0])
+                else:
+                    meter.reject("bounds")
 
-                if verbose:
-                    if __has_progressbar:
-                        pbar.update(counter)
-                    else:
-                        sys.stdout.write("Testing order {0}: {1}/{2} ({3:.2f}%)\r".format(order, counter, num_graphs_to_check, (float(counter)/num_graphs_to_check)*100))
-                    sys.stdout.flush()
+                counter += 1
+                meter.update()
 
             except StopIteration:
+                meter.finish()
                 if verbose:
-                    if __has_progressbar:
-                        pbar.finish()
-                    else:
-                        print
-
                     print "No difficult graphs found."
 
                 return None
 
     @classmethod
-    def next_difficult_graph(cls, order=None, verbose=True, save=False):
+    def next_difficult_graph(cls, order=None, verbose=True, save=False, background=False):
         # TODO: Is it possible to write good tests for this?
         r"""
         This function returns the smallest graph considered difficult by INP theory.
@@ -224,6 +1576,9 @@ class INPGraph(Graph):
 
         - ``save`` - boolean -- Save a PDF and PNG image of the difficult graph that is found.
 
+        - ``background`` - boolean -- Save the files in a background process
+          (see :meth:`export_queue`) instead of waiting for them.
+
         NOTES:
 
         The return value of this function may change depending on the functions
@@ -241,15 +1596,109 @@ class INPGraph(Graph):
             if order < 6:
                 raise ValueError, "There are no difficult graphs with less than 6 vertices."
 
-            n = order
+            n = order
+
+        while True:
+            try:
+                g = cls._next_difficult_graph_of_order(n, verbose, save, background)
+                if g is None:
+                    n += 1
+                else:
+                    cls._report_profile()
+                    return g
+            except KeyboardInterrupt:
+                if verbose:
+                    sys.stdout.flush()
+                    print "\nStopped."
+                cls._report_profile()
+                return None
+
+    @classmethod
+    def find_example(cls, func, order=1, verbose=True, prefilter=None, processes=None):
+        r"""
+        Returns the first connected graph that satisfies the given function.
+
+        INPUT:
+
+        - ``func`` - function -- The predicate the graph must satisfy.
+
+        - ``order`` - int -- Begin checking at graphs of the given order.
+
+        - ``verbose`` - boolean -- Print progress and show the graph found.
+
+        - ``prefilter`` - function -- A cheap predicate that graphs must also
+          satisfy, checked before ``func``.
+
+        - ``processes`` - int -- Check each order in this many processes.
+          The processes stop as soon as the graphs left to check come after a
+          graph that was found, so the graph returned does not depend on the
+          number of processes. If the order's :class:`GraphCorpus` exists,
+          the processes read it and the graph returned is the first one in
+          ``nauty-geng`` order, as when checking in a single process.
+          Otherwise each process streams its own ``nauty-geng res/mod``
+          shards of the order (see ``_find_example_shards``), and the graph
+          returned is the first one of the first shard that has one.
+
+        EXAMPLES:
+
+        ::
+            sage: g = INPGraph.find_example(INPGraph.has_magnet, verbose=False, processes=2)
+            sage: g.has_magnet()
+            True
+            sage: g == INPGraph.find_example(INPGraph.has_magnet, verbose=False, processes=3)
+            True
+        """
+        if not is_package_installed("nauty"): 
+            raise TypeError, "The nauty package is required to find graphs."
+
+        parallel = processes is not None and processes > 1
+
+        while True:
+            try:
+                corpus = None
+                if parallel:
+                    path = cls._corpus_file(order, "-c")
+                    if os.path.exists(path):
+                        corpus = GraphCorpus(path)
+                        num_graphs_to_check, exact = len(corpus), True
+                    else:
+                        num_graphs_to_check, exact = cls.count_graphs(order, "-c")
+                else:
+                    gen, num_graphs_to_check, exact = cls._search_graphs(order, "-c")
+        
+                if verbose:
+                    print "Testing {0}{1} graphs of order {2}.".format("" if exact else "about ", num_graphs_to_check, order)
+                meter = ProgressMeter(num_graphs_to_check, "Testing order {0}".format(order), verbose, cls._metrics_path)
+
+                g = None
+                if corpus is not None:
+                    index = cls._find_example_in_parallel(corpus, func, prefilter, processes, meter)
+                    if index is not None:
+                        g = corpus[index]
+                elif parallel:
+                    g, index = cls._find_example_in_shards(order, "-c", func, prefilter, processes, meter)
+                else:
+                    try:
+                        for index, h in enumerate(gen):
+                            if (prefilter is None or prefilter(h)) and func(h):
+                                g = h
+                                break
+                            meter.update()
+                    finally:
+                        gen.close()
+
+                meter.finish()
+                if g is None:
+                    if verbose:
+                        print "No example graphs found."
+                    order += 1
+                    continue
+
+                if verbose:
+                    print "Found an example graph: {0} (Checked {1}/{2} graphs of order {3}.)".format(g.graph6_string(), index, num_graphs_to_check, order)
+                    g.show()
+                return g
 
-        while True:
-            try:
-                g = cls._next_difficult_graph_of_order(n, verbose, save)
-                if g is None:
-                    n += 1
-                else:
-                    return g
             except KeyboardInterrupt:
                 if verbose:
                     sys.stdout.flush()
@@ -257,93 +1706,128 @@ class INPGraph(Graph):
                 return None
 
     @classmethod
-    def find_example(cls, func, order=1, verbose=True):
+    def _find_example_in_parallel(cls, corpus, func, prefilter, processes, meter):
         r"""
-        Returns the first connected graph that satisfies the given function.
+        Return the index of the first graph in ``corpus`` satisfying
+        ``prefilter`` and ``func``, or None, checking chunks of the corpus in
+        forked worker processes. If ``func`` or ``prefilter`` raises on a
+        graph before the first one satisfying them, the exception is raised
+        here, as it would be when checking in a single process.
         """
-        if not is_package_installed("nauty"): 
-            raise TypeError, "The nauty package is required to find graphs."
+        next_chunk = multiprocessing.Value('l', 0)
+        best = multiprocessing.Value('l', len(corpus))
+        errors = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_find_example_worker,
+                                           args=(corpus, func, prefilter, next_chunk, best, cls._find_example_chunk_size, errors))
+                   for i in range(processes)]
 
-        while True:
-            try:
-                output = subprocess.check_output(["{0}/local/bin/nauty-geng".format(SAGE_ROOT),
-                         "-cu", str(order)], stderr=subprocess.STDOUT)
-                m = cls._nauty_count_pattern.search(output)
-                num_graphs_to_check = int(m.group(1))
-        
-                if verbose:
-                    sys.stdout.write("Counting graphs of order {0}... ".format(order))
-                    sys.stdout.flush()
-                    print num_graphs_to_check
+        raised = cls._run_find_example_workers(workers, errors, meter, lambda: min(next_chunk.value, best.value))
 
-                    if __has_progressbar:
-                        pbar = ProgressBar(widgets=["Testing: ", Counter(), Bar(), ETA()], maxval=num_graphs_to_check, fd=sys.stdout).start()
+        if best.value in raised:
+            cls._raise_find_example_error(best.value, *raised[best.value])
 
-                gen = graphs.nauty_geng("-c {0}".format(order))
-                counter = 0
+        if best.value == len(corpus):
+            return None
+        return best.value
 
-                while True:
-                    try:
-                        g = INPGraph(gen.next())
-                        
-                        if func(g):
-                            if verbose:
-                                if __has_progressbar:
-                                    pbar.finish()
-                                print "Found an example graph: {0} (Checked {1}/{2} graphs of order {3}.)".format(g.graph6_string(), counter, num_graphs_to_check, order)
-
-                            g.show()
-                            return g
-
-                        counter += 1
-
-                        if verbose:
-                            if __has_progressbar:
-                                pbar.update(counter)
-                            else:
-                                sys.stdout.write("Testing order {0}: {1}/{2} ({3:.2f}%)\r".format(order, counter, num_graphs_to_check, (float(counter)/num_graphs_to_check)*100))
-                            sys.stdout.flush()
+    @classmethod
+    def _find_example_in_shards(cls, order, geng_args, func, prefilter, processes, meter):
+        r"""
+        Return the first graph of the first ``nauty-geng res/mod`` shard with
+        a graph satisfying ``prefilter`` and ``func``, and the number of graphs
+        checked, or ``(None, checked)``. The shards are streamed from
+        ``nauty-geng`` in forked worker processes, so no graphs are stored.
+        Exceptions are raised as in :meth:`_find_example_in_parallel`.
+        """
+        mod = cls._find_example_shards
+        next_shard = multiprocessing.Value('l', 0)
+        best = multiprocessing.Array('l', [mod, 0])
+        checked = multiprocessing.Value('l', 0)
+        found = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_find_example_shard_worker,
+                                           args=(order, geng_args, mod, func, prefilter, next_shard, best, checked,
+                                                 cls._find_example_chunk_size, found))
+                   for i in range(processes)]
+
+        witnesses = cls._run_find_example_workers(workers, found, meter, lambda: checked.value)
+
+        key = (best[0], best[1])
+        if key not in witnesses:
+            return None, checked.value
+
+        graph6, error = witnesses[key]
+        if error is not None:
+            cls._raise_find_example_error(key, *error)
+        return INPGraph(graph6), checked.value
 
-                    except StopIteration:
-                        if verbose:
-                            if __has_progressbar:
-                                pbar.finish()
-                            else:
-                                print
-                            print "No example graphs found."
-                        
-                        order += 1
-                        break
+    @classmethod
+    def _run_find_example_workers(cls, workers, results, meter, progress):
+        # Start the workers and wait for them, updating the meter from
+        # progress(). The (key, value) pairs the workers put on results are
+        # returned as a dictionary. They are read while waiting, as a worker
+        # can't exit before the items it sent are read.
+        for worker in workers:
+            worker.start()
+
+        received = {}
+        def read_results(timeout):
+            try:
+                while True:
+                    item = results.get(timeout=timeout)
+                    received[item[0]] = item[1:]
+            except Queue.Empty:
+                pass
 
-            except KeyboardInterrupt:
-                if verbose:
-                    sys.stdout.flush()
-                    print "\nStopped."
-                return None
+        try:
+            checked = 0
+            while any(worker.is_alive() for worker in workers):
+                read_results(1.0 / ProgressMeter._updates_per_second)
+                done = progress()
+                if done > checked:
+                    meter.update(done - checked)
+                    checked = done
+            read_results(0.1)
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+
+        # A worker that died may have left its graphs unchecked.
+        if any(worker.exitcode != 0 for worker in workers):
+            raise RuntimeError, "A find_example worker process died."
+
+        return received
 
+    @classmethod
+    def _raise_find_example_error(cls, key, e, tb):
+        if e is None:
+            raise RuntimeError, "Checking graph {0} failed:\n{1}".format(key, tb)
+        sys.stderr.write(tb)
+        raise e
 
-    def is_difficult(self):
+    def is_difficult(self, dossier=False):
         # TODO: Is it possible to write good tests for this?
         r"""
         This function determines if the graph is difficult as described by
-        INP theory.
+        INP theory. If ``dossier`` is true, the :class:`Dossier` of everything
+        that was evaluated is returned instead, with the answer in its
+        ``difficult`` attribute.
 
         NOTES:
 
         The return value of this function may change depending on the functions
         included in the _lower_bounds, _upper_bounds, and _alpha_properties
-        settings.
+        settings. On graphs with at least ``_alpha_reduce_order`` vertices, the
+        alpha properties in ``_alpha_reduction_properties`` are checked before
+        the others.
         """
-        if self.has_alpha_property():
-            return False
-
-        lbound = ceil(self.best_lower_bound())
-        ubound = floor(self.best_upper_bound())
+        result = Dossier(self)
+        result.decide()
 
-        if lbound == ubound:
-            return False
-
-        return True
+        if dossier:
+            return result
+        else:
+            return result.difficult
 
     def best_lower_bound(self):
         # TODO: Is it possible to write good tests for this?
@@ -356,18 +1840,7 @@ class INPGraph(Graph):
         The return value of this function may change depending on the functions
         included in the _lower_bounds setting.
         """
-        # The default bound is 1
-        lbound = 1
-
-        for func in self._lower_bounds:
-            try:
-                new_bound = func(self)
-                if new_bound > lbound:
-                    lbound = new_bound
-            except ValueError:
-                pass
-
-        return lbound
+        return Dossier(self).best_lower_bound()
 
     def best_upper_bound(self):
         # TODO: Is it possible to write good tests for this?
@@ -380,18 +1853,7 @@ class INPGraph(Graph):
         The return value of this function may change depending on the functions
         included in the _upper_bounds setting.
         """
-        # The default upper bound is the number of vertices
-        ubound = self.order()
-
-        for func in self._upper_bounds:
-            try:
-                new_bound = func(self)
-                if new_bound < ubound:
-                    ubound = new_bound
-            except ValueError:
-                pass
-
-        return ubound
+        return Dossier(self).best_upper_bound()
 
     def has_alpha_property(self):
         # TODO: Is it possible to write good tests for this?
@@ -404,27 +1866,50 @@ class INPGraph(Graph):
         The return value of this function may change depending on the functions
         included in the _alpha_properties setting.
         """
-        for func in self._alpha_properties:
-            try:
-                if func(self):
-                    return True
-            except ValueError:
-                pass
-
-        return False
+        return Dossier(self).has_alpha_property()
 
-    def save_files(self):
-        # TODO: Write documentation
+    def save_files(self, dossier=None, background=False):
         # TODO: Is it possible to write good tests for this?
+        r"""
+        Save a PNG plot and a PDF dossier of the graph into a new folder under
+        ``_save_path``, returning the folder and a list of error messages. A
+        :class:`Dossier` returned by :meth:`is_difficult` may be passed in so
+        that nothing already evaluated is computed again.
+
+        If ``background`` is true, the files are saved by the worker processes
+        of :meth:`export_queue` instead, and the ``AsyncResult`` of the export
+        is returned immediately.
+        """
+        if background:
+            return self.export_queue().submit(self, dossier)
+
         timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
         filename = "difficult_graph_{0}".format(timestamp)
         folder_path = "{0}/{1}".format(self._save_path, filename)
 
+        errors = []
+
+        # Exports running in parallel may start within the same second, so
+        # the folder is only ours if we are the ones who create it.
+        suffix = 1
         try:
-            if not os.path.exists(folder_path):
-                os.makedirs(folder_path)
-        except IOError:
-            "Can't make directory {0}".format(folder_path)
+            if not os.path.isdir(self._save_path):
+                os.makedirs(self._save_path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                errors.append("Can't make directory {0}".format(self._save_path))
+
+        while not errors:
+            try:
+                os.mkdir(folder_path)
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    errors.append("Can't make directory {0}".format(folder_path))
+                    break
+            suffix += 1
+            filename = "difficult_graph_{0}_{1}".format(timestamp, suffix)
+            folder_path = "{0}/{1}".format(self._save_path, filename)
 
         (saved_plot, saved_pdf) = (False, False)
 
@@ -433,39 +1918,77 @@ class INPGraph(Graph):
             #print "Plot saved to {0}{1}.png".format(folder_path, filename)
             saved_plot = True
         except IOError:
-            print "Couldn't save {0}/{1}.png".format(folder_path, filename)
+            errors.append("Couldn't save {0}/{1}.png".format(folder_path, filename))
+            print errors[-1]
 
         try:
-            self._export_pdf(folder_path, filename)
+            self._export_pdf(folder_path, filename, dossier)
             #print "Dossier saved to {0}{1}.pdf".format(folder_path, filename)
             saved_pdf = True
-        except IOError:
-            print "Couldn't save {0}/{1}.pdf".format(folder_path, filename)
+        except IOError as e:
+            errors.append("Couldn't save {0}/{1}.pdf: {2}".format(folder_path, filename, e))
+            print errors[-1]
 
         if saved_plot or saved_pdf:
             print "Saved graph information to: \n  {0}".format(folder_path)
 
-    def _export_pdf(self, folder_path, filename):
+        return (folder_path, errors)
+
+    @classmethod
+    def export_queue(cls, processes=None):
+        r"""
+        Return the :class:`ExportQueue` used by ``save_files(background=True)``,
+        starting it with the given number of worker processes if needed.
+
+        NOTES:
+
+        The queue is closed when the interpreter exits, so the exports that
+        are still queued are finished before multiprocessing terminates the
+        worker processes.
+        """
+        if cls._export_queue is None:
+            INPGraph._export_queue = ExportQueue(processes)
+            atexit.register(INPGraph._export_queue.close)
+        return cls._export_queue
+
+    @classmethod
+    def _pdflatex(cls):
+        r"""
+        Return the path of the pdflatex executable, looking for it on the
+        ``PATH`` and in TeXShop's ``/usr/texbin`` the first time.
+        """
+        if cls._pdflatex_path is None:
+            path = find_executable('pdflatex')
+            if path is None and os.path.exists('/usr/texbin/pdflatex'):
+                path = '/usr/texbin/pdflatex'
+            if path is None:
+                raise IOError("pdflatex was not found.")
+            INPGraph._pdflatex_path = path
+        return cls._pdflatex_path
+
+    def _export_pdf(self, folder_path, filename, dossier=None):
         # TODO: Write documentation
         # TODO: Is it possible to write good tests for this?
         # TODO: Check for tkz style files
 
-        if self.is_difficult():
+        if dossier is None:
+            dossier = self.is_difficult(dossier=True)
+        dossier.complete()
+
+        if dossier.difficult:
             difficult_text = "\\textbf{This graph is difficult!} & \\danger \\\\"
         else:
             difficult_text = ""
         
         # Generate the latex for the alpha properties table
         alphaproperties = {}
-        for func in self._alpha_properties:
-            name = func.__name__
-            try:
-                if func(self):
-                    print_value = "\ding{51}"
-                else:
-                    print_value = "\ding{56}"
-            except ValueError:
+        for name, entry in dossier.alpha_properties.iteritems():
+            if entry.error is not None:
                 print_value = "$\\varnothing$"
+            elif entry.value:
+                print_value = "\ding{51}"
+            else:
+                print_value = "\ding{56}"
             alphaproperties[name] = print_value
 
         # Sort by name ascending
@@ -479,19 +2002,18 @@ class INPGraph(Graph):
 
         # Generate the latex for the lower bounds table
         lowerbounds = {}
-        for func in self._lower_bounds:
-            name = func.__name__
-            try:
-                sort_value = func(self)
+        for name, entry in dossier.lower_bounds.iteritems():
+            if entry.error is not None:
+                sort_value = -1
+                print_value = "$\\varnothing$"
+            else:
+                sort_value = entry.value
                 if sort_value in ZZ:
                     print_value = Integer(sort_value).str()
                 elif sort_value in RR:
                     print_value = "{0:.3f}".format(float(sort_value))
                 else:
                     print_value = self._latex_escape(str(sort_value))
-            except ValueError:
-                sort_value = -1
-                print_value = "$\\varnothing$"
             lowerbounds[name] = (sort_value, print_value)
 
         # Sort by sort_value ascending, then by name ascending
@@ -505,26 +2027,24 @@ class INPGraph(Graph):
                      "{0} & {1} \\\\\n".format(self._latex_escape(name), print_value)
 
             except (AttributeError, ValueError):
-                print "Can't format", name, value, "for LaTeX output."
+                print "Can't format", name, print_value, "for LaTeX output."
                 lowerbounds_table += \
                     "{0} & {1} \\\\\n".format(self._latex_escape(name), '?')
 
         # Generate the latex for the upper bounds table
         upperbounds = {}
-        for func in self._upper_bounds:
-            name = func.__name__
-            try:
-                sort_value = func(self)
+        for name, entry in dossier.upper_bounds.iteritems():
+            if entry.error is not None:
+                sort_value = sys.maxint
+                print_value = "$\\varnothing$"
+            else:
+                sort_value = entry.value
                 if sort_value in ZZ:
                     print_value = Integer(sort_value).str()
                 elif sort_value in RR:
                     print_value = "{0:.3f}".format(float(sort_value))
                 else:
                     print_value = self._latex_escape(str(sort_value))
-
-            except ValueError:
-                sort_value = sys.maxint
-                print_value = "$\\varnothing$"
             upperbounds[name] = (sort_value, print_value)
 
         # Sort by sort_value ascending, then by name ascending
@@ -538,7 +2058,7 @@ class INPGraph(Graph):
                      "{0} & {1} \\\\\n".format(self._latex_escape(name), print_value)
 
             except (AttributeError, ValueError):
-                print "Can't format", name, value, "for LaTeX output."
+                print "Can't format", name, print_value, "for LaTeX output."
                 upperbounds_table += \
                     "{0} & {1} \\\\\n".format(self._latex_escape(name), '?')
 
@@ -563,7 +2083,7 @@ class INPGraph(Graph):
                               difficult=difficult_text,
                               order=self.order(),
                               size=self.size(),
-                              alpha=self.independence_number(),
+                              alpha=dossier.alpha,
                               alphaproperties=alphaproperties_table,
                               lowerbounds=lowerbounds_table, 
                               upperbounds=upperbounds_table,
@@ -572,17 +2092,20 @@ class INPGraph(Graph):
         latex_filename = "{0}/{1}.tex".format(folder_path, filename)
 
         # Write the latex to a file then run pdflatex on it
-        # TODO: Handle calling pdflatex and its errors better.
+        latex_file = open(latex_filename, 'w')
+        latex_file.write(output)
+        latex_file.close()
+
         try:
-            latex_file = open(latex_filename, 'w')
-            latex_file.write(output)
-            latex_file.close()
             with open(os.devnull, 'wb') as devnull:
-                subprocess.call(['/usr/texbin/pdflatex', '-output-directory',
+                status = subprocess.call([self._pdflatex(), '-output-directory',
                     folder_path, latex_filename],
                     stdout=devnull, stderr=subprocess.STDOUT)
-        except:
-            print "Creating PDF failed."
+        except OSError as e:
+            raise IOError("Running pdflatex failed: {0}".format(e))
+
+        if status != 0:
+            raise IOError("pdflatex exited with status {0}.".format(status))
 
     @classmethod
     def _latex_escape(cls, str):
@@ -640,6 +2163,11 @@ class INPGraph(Graph):
         g.add_path([0] + range(n)[1:i+1])
         g.add_path([0] + range(n)[i+1:i+j+1])
         g.add_path([0] + range(n)[i+j+1:i+j+k+1])
+
+        # A maximum independent set takes every other vertex of each leg,
+        # starting from its end, and also the center if no leg has odd length.
+        alpha = sum((l + 1) / 2 for l in [i, j, k]) + max(0, 1 - len([l for l in [i, j, k] if l % 2 == 1]))
+        g.set_family("superclaw", independence_number=alpha, lovasz_theta=float(alpha))
         return g
 
     @classmethod
@@ -649,7 +2177,9 @@ class INPGraph(Graph):
     @classmethod
     def LatinSquareGraph(cls, ls, default_pos=False):
         r"""
-        Construct a graph from the given Latin square.
+        Construct a graph from the given Latin square. If ``default_pos`` is
+        True, the layout that shows off the row and column cliques is not
+        computed, which saves time on large squares.
 
         EXAMPLES:
 
@@ -674,6 +2204,11 @@ class INPGraph(Graph):
             sage: g = INPGraph.LatinSquareGraph([[0,1,2],[1,2,0],[2,0,1]])
             sage: g.num_edges()
             27
+
+        ::
+            sage: g = INPGraph.LatinSquareGraph(back_circulant(10), default_pos=True)
+            sage: g.order(), g.num_edges(), g.is_regular(27)
+            (100, 1350, True)
         """
         if not isinstance(ls, LatinSquare):
             ls = LatinSquare(matrix(ZZ, ls))
@@ -685,25 +2220,32 @@ class INPGraph(Graph):
             raise ValueError, "Matrix is not square."
 
         n = ls.nrows()
-        g = INPGraph()
-        pos = {}
+        cells = [(i, j, ls[i,j]) for i in range(n) for j in range(n)]
 
-        # Readjust the vertices on a bell curve to show off the row
-        # and column cliques.
-        f = lambda a, b, x: a * exp(-(b * (x - 0.5*(n-1)))**2)
+        # Two cells are adjacent if they share a row, a column or a symbol,
+        # so the graph is the union of a clique on each of these classes.
+        # Two distinct cells share at most one of them, so no edge is
+        # generated twice.
+        classes = {}
+        for cell in cells:
+            for k in range(3):
+                classes.setdefault((k, cell[k]), []).append(cell)
 
-        for i in range(n):
-            for j in range(n):
-                g.add_vertex((i, j, ls[i,j]))
-
-                pos[(i, j, ls[i,j])] = [j+f(1.2,0.5,n-i-1), n-i-1+f(1.2,0.5,j)]
-                for (row, col, val) in g.vertices():
-                    if row == i and col == j: next
-                    if row == i or col == j or val == ls[i,j]:
-                        g.add_edge((row, col, val), (i, j, ls[i,j]))
+        g = INPGraph()
+        g.add_vertices(cells)
+        g.add_edges(e for c in classes.itervalues() for e in combinations(c, 2))
 
         if not default_pos:
-            g.set_pos(pos)
+            # Readjust the vertices on a bell curve to show off the row
+            # and column cliques.
+            f = lambda a, b, x: a * exp(-(b * (x - 0.5*(n-1)))**2)
+            g.set_pos(dict(((i, j, v), [j+f(1.2,0.5,n-i-1), n-i-1+f(1.2,0.5,j)]) for (i, j, v) in cells))
+
+        # For n >= 3 the graph is strongly regular with parameters
+        # (n^2, 3(n-1), n, 6), and the Hoffman bound gives theta exactly.
+        if n >= 3:
+            g.set_family("latin_square", lovasz_theta=float(n),
+                         spectrum=[Integer(3*(n-1))] + [Integer(n-3)]*(3*(n-1)) + [Integer(-3)]*((n-1)*(n-2)))
 
         return g
 
@@ -742,6 +2284,7 @@ class INPGraph(Graph):
 
     mu = matching_number
 
+    @profile_graphs
     def independence_number(self):
         r"""
         Compute the independence number using the Sage built-in independent_set
@@ -767,7 +2310,22 @@ class INPGraph(Graph):
             2
             sage: INPGraph(graphs.PetersenGraph()).alpha()
             4
+
+        NOTES:
+        Graphs with at least ``_alpha_reduce_order`` vertices are first
+        reduced with :meth:`alpha_reduce`, and Cliquer is run on the kernel.
+        Graphs of a known family (see :meth:`family`) use the family's value.
         """
+        known = self.family_invariant('independence_number')
+        if known is not None:
+            return int(known)
+
+        if self.order() >= self._alpha_reduce_order:
+            kernel, offset = self.alpha_reduce()
+            if kernel.order() == 0:
+                return offset
+            return offset + int(len(kernel.independent_set()))
+
         return int(len(self.independent_set()))
 
     alpha = independence_number
@@ -843,24 +2401,69 @@ class INPGraph(Graph):
     def max_degree(self):
         # TODO: Write tests
         # TODO: Write documentation
-        return max(self.degree())
+        return max(self.context('degree'))
 
     def min_degree(self):
         # TODO: Write tests
         # TODO: Write documentation
-        return min(self.degree())
+        return min(self.context('degree'))
 
     def is_theta_stable(self, certificate=False):
-        for r in range(1, self.order()):
-            # print r
-            for s in Combinations(self.vertices(), r):
-                # print s, "----",list(set(self.vertices())-set(s))
-                h = self.subgraph(s)
-                hc = self.subgraph(set(self.vertices()) - set(s))
-                g_alpha = self.alpha()
-                h_alpha = h.alpha()
-                hc_alpha = hc.alpha()
-                if h_alpha == h.lovasz_theta() and g_alpha == h_alpha + hc_alpha:
+        r"""
+        Returns true if the graph has a nonempty proper subset of vertices `S`
+        such that `\alpha(G[S]) = \vartheta(G[S])` and
+        `\alpha(G[S]) + \alpha(G[S^\text{c}]) = \alpha(G)`. If ``certificate``
+        is true, the subgraph `G[S]` is returned as well.
+
+        EXAMPLES:
+
+        ::
+            sage: INPGraph(graphs.PathGraph(3)).is_theta_stable()
+            True
+            sage: INPGraph(graphs.CycleGraph(5)).is_theta_stable()
+            False
+
+        NOTES:
+        This algorithm does not run in polynomial time. The Lovasz theta
+        function is only computed for subsets passing the independence number
+        test, and is computed once per isomorphism class of subgraph. When the
+        automorphism group has at most ``_theta_stable_group_limit`` elements,
+        subsets passing the test are also skipped unless they are the smallest
+        (as bitmasks) in their orbit, which saves building their subgraphs.
+        """
+        verts, masks = self.context('neighbor_bitsets')
+        n = len(verts)
+        full = (1 << n) - 1
+        alpha_cache = {}
+        theta_cache = {}
+        g_alpha = _bitset_alpha(masks, full, alpha_cache)
+
+        group = self.automorphism_group()
+        if group.order() <= self._theta_stable_group_limit:
+            domain = sorted(group.domain())
+            index = dict((d, i) for i, d in enumerate(domain))
+            permutations = [[index[p(d)] for d in domain] for p in group if not p.is_one()]
+        else:
+            permutations = []
+
+        for r in range(1, n):
+            for s in combinations(range(n), r):
+                mask = sum(1 << i for i in s)
+
+                h_alpha = _bitset_alpha(masks, mask, alpha_cache)
+                hc_alpha = _bitset_alpha(masks, full & ~mask, alpha_cache)
+                if h_alpha + hc_alpha != g_alpha:
+                    continue
+
+                if any(sum(1 << p[i] for i in s) < mask for p in permutations):
+                    continue
+
+                h = self.subgraph([verts[i] for i in s])
+                key = h.canonical_label().graph6_string()
+                if key not in theta_cache:
+                    theta_cache[key] = h.lovasz_theta()
+
+                if h_alpha == theta_cache[key]:
                     if certificate:
                         return (True, h)
                     else:
@@ -871,7 +2474,6 @@ class INPGraph(Graph):
         else:
             return False
 
-
     def is_stable_block(self, s):
         return self.is_independent_set(s) and \
             len(s) == self.closed_neighborhood_subgraph(s).independence_number()
@@ -908,64 +2510,238 @@ class INPGraph(Graph):
         #                 blocks.append(S)
         # return blocks
 
+        # Independent sets are grown one vertex at a time as in
+        # independent_set_iterator(), carrying the bitmask of their closed
+        # neighborhood. The independence number of each closed neighborhood
+        # is memoized by bitmask and shared by every set with that
+        # neighborhood.
+        verts, masks = self.context('neighbor_bitsets')
+        n = len(verts)
+        cache = {}
+
         if trivial:
-            stability = lambda s: len(s) == self.closed_neighborhood_subgraph(s).independence_number()
+            blocks = [[]]
+            max_size = n
         else:
-            alpha = self.independence_number()
-            stability = lambda s: len(s) > 0 and len(s) < alpha and len(s) == self.closed_neighborhood_subgraph(s).independence_number()
+            blocks = []
+            max_size = _bitset_alpha(masks, (1 << n) - 1, cache) - 1
+
+        level = [((), (1 << n) - 1, 0)]
+
+        while level:
+            next_level = []
+            for s, candidates, neighborhood in level:
+                while candidates:
+                    low = candidates & -candidates
+                    candidates ^= low
+                    i = low.bit_length() - 1
+                    t = s + (i,)
+                    t_candidates = candidates & ~masks[i]
+                    t_neighborhood = neighborhood | masks[i] | low
+                    t_alpha = _bitset_alpha(masks, t_neighborhood, cache)
+
+                    if t_alpha == len(t) and len(t) <= max_size:
+                        blocks.append([verts[j] for j in t])
+
+                    # The closed neighborhood of any superset of t contains
+                    # that of t, so a superset can only be stable if it has at
+                    # least t_alpha vertices.
+                    if len(t) < max_size and t_alpha <= len(t) + _popcount(t_candidates):
+                        next_level.append((t, t_candidates, t_neighborhood))
+            level = next_level
+
+        return blocks
+
+    def _neighbor_bitsets(self):
+        r"""
+        Return the list of vertices and a list of bitmasks, where bit `j` of
+        the `i`-th mask is set if the `i`-th and `j`-th vertices are adjacent.
+
+        EXAMPLES:
+
+        ::
+            sage: INPGraph(graphs.PathGraph(3))._neighbor_bitsets()
+            ([0, 1, 2], [2, 5, 2])
+        """
+        verts = self.vertices()
+        index = dict((v, i) for i, v in enumerate(verts))
+        masks = [0] * len(verts)
+
+        for u, v in self.edge_iterator(labels=False):
+            masks[index[u]] |= 1 << index[v]
+            masks[index[v]] |= 1 << index[u]
+
+        return verts, masks
+
+    def independent_set_iterator(self, vertices=None):
+        r"""
+        Iterate over all independent sets in the graph, including the empty
+        set, in order of increasing size. Sets of the same size are produced
+        in lexicographic order of their vertices. If ``vertices`` is given,
+        only the independent sets contained in it are produced.
 
-        return filter(stability, self.independent_sets())
+        EXAMPLES:
+
+        ::
+            sage: list(INPGraph(graphs.PathGraph(3)).independent_set_iterator())
+            [[], [0], [1], [2], [0, 2]]
+            sage: len(list(INPGraph(graphs.PetersenGraph()).independent_set_iterator()))
+            76
+            sage: list(INPGraph(graphs.PathGraph(3)).independent_set_iterator([1, 2]))
+            [[], [1], [2]]
+
+        NOTES:
+        Each independent set is built from a smaller one by adding a vertex
+        from a bitmask of the remaining non-adjacent vertices, so only
+        independent sets are ever visited. The sets are extended depth-first,
+        in one pass for each size, so only the current set and one bitmask
+        per vertex in it are kept in memory.
+        """
+        verts, masks = self.context('neighbor_bitsets')
+
+        if vertices is None:
+            allowed = (1 << len(verts)) - 1
+        else:
+            allowed = 0
+            for i, v in enumerate(verts):
+                if v in vertices:
+                    allowed |= 1 << i
+
+        yield []
+
+        k = 1
+        found = True
+        while found:
+            found = False
+
+            # stack[j] is the bitmask of vertices that may still extend the
+            # first j vertices of s.
+            s = []
+            stack = [allowed]
+            while stack:
+                candidates = stack[-1]
+                if _popcount(candidates) < k - len(s):
+                    stack.pop()
+                    if s:
+                        s.pop()
+                    continue
+
+                low = candidates & -candidates
+                candidates ^= low
+                stack[-1] = candidates
+                i = low.bit_length() - 1
+                if len(s) + 1 == k:
+                    found = True
+                    yield [verts[j] for j in s + [i]]
+                else:
+                    s.append(i)
+                    stack.append(candidates & ~masks[i])
+            k += 1
 
     def independent_sets(self):
         r"""
         Return a list of all independent sets in the graph.
 
         NOTES:
-        This is a naive algorithm and does not run in polynomial time.
+        This algorithm does not run in polynomial time, but only visits
+        independent sets. Use :meth:`independent_set_iterator` to avoid
+        building the whole list.
         """
-        alpha = self.independence_number()
-        sets = [[]]
-        for k in range(1, alpha + 1):
-            # combinations_iterator is deprecated.
-            #for S in combinations_iterator(self.vertices(), k):
-            for S in Combinations(self.vertices(), k):
-                if self.is_independent_set(S):
-                    sets.append(S)
-        return sets
+        return list(self.independent_set_iterator())
+
+    def critical_difference(self):
+        r"""
+        Return the critical difference `d(G)`, the maximum of `|I| - |N(I)|`
+        over all independent sets `I`. This is computed in polynomial time,
+        since `d(G) = \alpha(B) - n` for the bipartite double cover `B`.
+
+        EXAMPLES:
+
+        ::
+            sage: INPGraph(graphs.CompleteGraph(3)).critical_difference()
+            0
+            sage: INPGraph(graphs.PathGraph(3)).critical_difference()
+            1
+            sage: INPGraph(graphs.StarGraph(3)).critical_difference()
+            2
+        """
+        b = self.bipartite_double_cover()
+        return b.order() - b.matching_number() - self.order()
+
+    def critical_independent_set_iterator(self):
+        r"""
+        Iterate over all critical independent sets in the graph, that is, the
+        independent sets `I` maximizing `|I| - |N(I)|`, in order of increasing
+        size.
+
+        EXAMPLES:
+
+        ::
+            sage: list(INPGraph('Cx').critical_independent_set_iterator())
+            [[], [3], [0, 3], [1, 3]]
+            sage: list(INPGraph(graphs.PathGraph(3)).critical_independent_set_iterator())
+            [[0, 2]]
+
+        NOTES:
+        This algorithm does not run in polynomial time. The critical
+        difference is computed first, and only independent sets inside
+        :meth:`union_MCIS`, which contains every critical independent set,
+        are examined.
+        """
+        d = self.critical_difference()
+        for I in self.independent_set_iterator(self.union_MCIS()):
+            if len(I) - len(self.open_neighborhood(I)) == d:
+                yield I
 
     def critical_independent_sets(self):
         r"""
         Return a list of all critical independent sets in the graph.
 
         NOTES:
-        This is a naive algorithm and does not run in polynomial time.
+        This algorithm does not run in polynomial time, see
+        :meth:`critical_independent_set_iterator`.
         """
-        cis = {}
-        for I in self.independent_sets():
-            key = len(I) - len(self.open_neighborhood(I))
-            if key in cis:
-                cis[key].append(I)
-            else:
-                cis[key] = [I]
-        return cis[max(cis.keys())]
+        return list(self.critical_independent_set_iterator())
     cis = critical_independent_sets
 
     def critical_independence_number(self):
-        return max(len(I) for I in self.critical_independent_sets())
+        r"""
+        Return the critical independence number `\alpha_c`, the size of a
+        maximum critical independent set.
+
+        EXAMPLES:
+
+        ::
+            sage: INPGraph('Cx').critical_independence_number()
+            2
+            sage: INPGraph(graphs.CycleGraph(4)).critical_independence_number()
+            2
+            sage: INPGraph(graphs.StarGraph(3)).critical_independence_number()
+            3
+            sage: INPGraph(graphs.CompleteGraph(3)).critical_independence_number()
+            0
+
+        NOTES:
+        This runs in polynomial time. If `X` is the union of all maximum
+        critical independent sets, then `G[X \cup N(X)]` is a KE graph whose
+        maximum independent sets are the maximum critical independent sets,
+        so `\alpha_c = (|X \cup N(X)| + d(G))/2`.
+        """
+        J = self.closed_neighborhood(self.union_MCIS())
+        return (len(J) + self.critical_difference()) // 2
     alpha_c = critical_independence_number
 
     def block_survey(self):
-        SB = self.stable_blocks()
-        CIS = self.critical_independent_sets()
-        IS = self.independent_sets()
+        SB = set(tuple(I) for I in self.stable_blocks())
+        CIS = set(tuple(I) for I in self.critical_independent_sets())
         alpha = self.independence_number()
         alpha_c = self.critical_independence_number()
 
-        for I in IS:
+        for I in self.independent_set_iterator():
             output = str(I)
-            if I in SB:
+            if tuple(I) in SB:
                 output += " Stable"
-            if I in CIS:
+            if tuple(I) in CIS:
                 output += " CIS"
                 if len(I) == alpha_c:
                     output += " MaxCIS"
@@ -999,6 +2775,111 @@ class INPGraph(Graph):
 
         return result
 
+    def _alpha_reduction(self):
+        r"""
+        Apply one alpha-reduction to a copy of the graph, returning the
+        reduced graph and the amount by which its independence number is
+        smaller than the graph's, or None if no reduction applies.
+        """
+        verts, masks = self.context('neighbor_bitsets')
+
+        # A simplicial vertex is in some maximum independent set.
+        for i in range(len(verts)):
+            if _bitset_is_clique(masks, masks[i]):
+                g = self.copy()
+                g.delete_vertices(self.closed_neighborhood(verts[i]))
+                return (g, 1)
+
+        # Folding at v lowers alpha by exactly one.
+        for i in range(len(verts)):
+            foldable, nonedges = _bitset_fold_data(masks, i)
+            if foldable and nonedges < _popcount(masks[i]) + 1:
+                return (self.fold_at(verts[i]), 1)
+
+        # Replacing a magnetic pair by a single vertex adjacent to their
+        # common neighbors does not change alpha.
+        has_magnet, pair = self.has_magnet(certificate=True)
+        if has_magnet:
+            a, b = pair
+            common = set(self.neighbors(a)) & set(self.neighbors(b))
+            g = self.copy()
+            g.delete_vertices([a, b])
+            g.add_vertex(a)
+            g.add_edges((a, w) for w in common)
+            return (g, 0)
+
+        # The KE part X + N(X), where X is the union of maximum critical
+        # independent sets, contributes exactly alpha_c to alpha.
+        X = self.union_MCIS()
+        if X:
+            J = self.closed_neighborhood(X)
+            g = self.copy()
+            g.delete_vertices(J)
+            return (g, (len(J) + self.critical_difference()) // 2)
+
+        return None
+
+    def alpha_reduce(self):
+        r"""
+        Return a pair ``(kernel, offset)`` such that
+        `\alpha(G) = \alpha(kernel) + offset`, where the kernel is found by
+        repeatedly removing the closed neighborhood of a simplicial vertex,
+        folding at a vertex where folding removes vertices, replacing a
+        magnetic pair by a vertex adjacent to their common neighbors, and
+        removing the KE part `X \cup N(X)` where `X` is
+        :meth:`union_MCIS`, until none of these applies. The vertices of the
+        kernel are labeled `0, \ldots, n-1`.
+
+        EXAMPLES:
+
+        ::
+            sage: g, offset = INPGraph(graphs.PathGraph(5)).alpha_reduce()
+            sage: g.order(), offset
+            (0, 3)
+            sage: g, offset = INPGraph(graphs.PetersenGraph()).alpha_reduce()
+            sage: g.order(), offset
+            (10, 0)
+
+            sage: g, offset = INPGraph(graphs.CompleteBipartiteGraph(3, 3)).alpha_reduce()
+            sage: g.independence_number() + offset
+            3
+        """
+        kernel = self.copy()
+        kernel.relabel()
+        offset = 0
+
+        while kernel.order() > 0:
+            reduction = kernel._alpha_reduction()
+            if reduction is None:
+                break
+
+            kernel, gained = reduction
+            kernel.relabel()
+            offset += gained
+
+        return kernel, offset
+
+    def fold_analysis(self):
+        r"""
+        Return a dictionary mapping each vertex `v` to a pair
+        ``(foldable, nonedges)``, where ``foldable`` is true if `N(v)` contains
+        no anti-triangles and ``nonedges`` is the number of pairs of
+        non-adjacent vertices in `N(v)`. Folding at a foldable vertex `v`
+        produces a graph with ``nonedges - deg(v) - 1`` more vertices.
+
+        EXAMPLES:
+
+        ::
+            sage: INPGraph('EqW_').fold_analysis()
+            {0: (True, 1), 1: (False, 3), 2: (False, 3), 3: (True, 0), 4: (True, 1), 5: (True, 0)}
+
+        NOTES:
+        All vertices are analyzed in one pass over the neighbor bitmasks,
+        without building any neighborhood subgraphs.
+        """
+        verts, masks = self.context('neighbor_bitsets')
+        return dict((v, _bitset_fold_data(masks, i)) for i, v in enumerate(verts))
+
     def has_foldable_vertex(self):
         r"""
         Returns true if the graph has a foldable vertex, defined in
@@ -1017,14 +2898,8 @@ class INPGraph(Graph):
             sage: INPGraph(graphs.CompleteBipartiteGraph(3, 3)).has_foldable_vertex()
             False
         """
-        # for v in self.vertices():
-        #     if self.has_foldable_vertex_at(v):
-        #         return True
-        # return False
-
-        # This any/imap version should be faster.
-        return any(imap(self.has_foldable_vertex_at, self.vertices()))
-
+        verts, masks = self.context('neighbor_bitsets')
+        return any(_bitset_fold_data(masks, i)[0] for i in range(len(verts)))
 
     def has_foldable_vertex_at(self, v):
         r"""
@@ -1045,7 +2920,8 @@ class INPGraph(Graph):
             False
         """
         # Returns True if N(v) contains no anti-triangles
-        return self.open_neighborhood_subgraph(v).complement().is_triangle_free()
+        verts, masks = self.context('neighbor_bitsets')
+        return _bitset_fold_data(masks, verts.index(v))[0]
 
     def fold_at(self, v):
         r"""
@@ -1062,21 +2938,26 @@ class INPGraph(Graph):
             sage: G.fold_at(0).graph6_string()
             'E?dw'
         """
-        if not self.has_foldable_vertex_at(v):
+        verts, masks = self.context('neighbor_bitsets')
+        i = verts.index(v)
+
+        if not _bitset_fold_data(masks, i)[0]:
             raise ValueError, "The graph is not foldable at vertex " + str(v)
 
+        # The non-adjacent pairs in N(v), in the order of the vertices.
+        Nv = [j for j in range(len(verts)) if masks[i] >> j & 1]
+        antiedges = [(verts[a], verts[b]) for a in Nv for b in Nv if a < b and not masks[a] >> b & 1]
+
         g = self.copy()
-        Nv = self.closed_neighborhood_subgraph(v)
-        Nv_c = Nv.complement()
         new_nodes = []
 
-        for (i,j) in Nv_c.edge_iterator(labels=False):
-            g.add_vertex((i,j))
-            g.add_edges([(i,j), w] for w in self.open_neighborhood([i, j]))
-            g.add_edges([(i,j), w] for w in new_nodes)
-            new_nodes += [(i,j)]
+        for (a, b) in antiedges:
+            g.add_vertex((a, b))
+            g.add_edges([(a, b), w] for w in self.open_neighborhood([a, b]))
+            g.add_edges([(a, b), w] for w in new_nodes)
+            new_nodes += [(a, b)]
 
-        g.delete_vertices(Nv.vertices())
+        g.delete_vertices(self.closed_neighborhood(v))
         return g
 
     def is_bull_free(self):
@@ -1143,6 +3024,33 @@ class INPGraph(Graph):
     def is_skew_star_free(self):
         return self.subgraph_search(INPGraph.SkewStar(), induced=True) is None
 
+    def degree_profile(self):
+        r"""
+        Return a pair of NumPy arrays ``(degrees, simplicial)``, indexed in the
+        order of :meth:`vertices`, where ``simplicial[i]`` is true if the
+        neighborhood of the `i`-th vertex is a clique.
+
+        EXAMPLES:
+
+        ::
+            sage: degrees, simplicial = INPGraph(graphs.PathGraph(3)).degree_profile()
+            sage: list(degrees), list(simplicial)
+            ([1, 2, 1], [True, False, True])
+            sage: degrees, simplicial = INPGraph(graphs.CycleGraph(4)).degree_profile()
+            sage: simplicial.any()
+            False
+
+        NOTES:
+        For the adjacency matrix `A`, the `i`-th row sum of `A^2 \circ A`
+        counts twice the edges inside `N(v_i)`, so the neighborhood is a
+        clique exactly when it equals `d(v_i)(d(v_i) - 1)`. This checks all
+        vertices at once without building any subgraphs.
+        """
+        A = self.adjacency_matrix().numpy(dtype=numpy.int64)
+        degrees = A.sum(axis=1)
+        inner = (A.dot(A) * A).sum(axis=1)
+        return degrees, inner == degrees * (degrees - 1)
+
     ###########################################################################
     # Alpha properties
     ###########################################################################
@@ -1160,7 +3068,8 @@ class INPGraph(Graph):
             sage: INPGraph(graphs.PathGraph(5)).has_max_degree_order_minus_one()
             False
         """
-        return self.max_degree() == self.order() - 1
+        degrees, simplicial = self.context('degree_profile')
+        return bool((degrees == self.order() - 1).any())
     has_max_degree_order_minus_one._is_alpha_property = True
 
     def is_claw_free(self):
@@ -1195,7 +3104,8 @@ class INPGraph(Graph):
             sage: INPGraph(graphs.PathGraph(3)).has_pendant_vertex()
             True
         """
-        return 1 in self.degree()
+        degrees, simplicial = self.context('degree_profile')
+        return bool((degrees == 1).any())
     has_pendant_vertex._is_alpha_property = True
 
     def has_simplicial_vertex(self):
@@ -1211,14 +3121,8 @@ class INPGraph(Graph):
             sage: INPGraph(graphs.CompleteGraph(4)).has_simplicial_vertex()
             True
         """
-        # for v in self.vertices():
-        #     if self.open_neighborhood_subgraph(v).is_clique():
-        #         return True
-        # return False
-
-        # This any/imap version should be faster.
-        neighborhood_is_clique = lambda v: self.open_neighborhood_subgraph(v).is_clique()
-        return any(imap(neighborhood_is_clique, self.vertices()))
+        degrees, simplicial = self.context('degree_profile')
+        return bool(simplicial.any())
     has_simplicial_vertex._is_alpha_property = True
 
     @memoize_graphs
@@ -1322,28 +3226,35 @@ class INPGraph(Graph):
     has_nonempty_KE_part._is_alpha_property = True
 
     def is_fold_reducible(self):
-        # TODO: Write tests
-        # TODO: Write documentation
-        if not self.has_foldable_vertex():
-            return False
+        r"""
+        Returns true if the graph has a foldable vertex `v` such that folding
+        at `v` produces a graph with fewer vertices, that is, `N(v)` has fewer
+        than `deg(v) + 1` pairs of non-adjacent vertices.
 
-        for v in self.vertices():
-            if self.has_foldable_vertex_at(v):
-                #if self.fold_at(v).order() < n:
-                # We should be able to estimate this without actually folding
-                Nv = self.closed_neighborhood_subgraph(v)
-                Nv_c = Nv.complement()
-                if Nv_c.size() - Nv.order() < 0:
-                    return True
+        EXAMPLES:
+
+        ::
+            sage: INPGraph('EqW_').is_fold_reducible()
+            True
+            sage: INPGraph(graphs.CompleteBipartiteGraph(3, 3)).is_fold_reducible()
+            False
+        """
+        verts, masks = self.context('neighbor_bitsets')
+
+        for i in range(len(verts)):
+            foldable, nonedges = _bitset_fold_data(masks, i)
+            if foldable and nonedges < _popcount(masks[i]) + 1:
+                return True
         return False
     is_fold_reducible._is_alpha_property = True
 
-    def has_magnet(self):
+    def has_magnet(self, certificate=False):
         r"""
         Return true if the graph contains a magnetically-attracted pair, that is,
         adjacent vertices `a` and `b` such that `N(a) \setminus N(b)` is completely
         linked to `N(b) \setminus N(a)`. This definition is stated in
-        Leveque-de Werra 2011.
+        Leveque-de Werra 2011. If ``certificate`` is true, the pair `(a, b)`
+        is returned as well, or None if there is no magnet.
 
         EXAMPLES:
 
@@ -1354,16 +3265,41 @@ class INPGraph(Graph):
         The killer does ::
             sage: INPGraph.KillerGraph().has_magnet()
             True
+            sage: INPGraph(graphs.PathGraph(3)).has_magnet(certificate=True)
+            (True, (0, 1))
         """
-        for a, b in self.edge_iterator(labels=False):
-            Na_minus_Nb = set(self.neighbors(a)).difference(self.neighbors(b))
-            Nb_minus_Na = set(self.neighbors(b)).difference(self.neighbors(a))
+        verts, masks = self.context('neighbor_bitsets')
+
+        for a in range(len(verts)):
+            # Only consider each edge once, with a < b.
+            rest = masks[a] >> (a + 1) << (a + 1)
+            while rest:
+                low = rest & -rest
+                rest ^= low
+                b = low.bit_length() - 1
+
+                Na_minus_Nb = masks[a] & ~masks[b]
+                Nb_minus_Na = masks[b] & ~masks[a]
+
+                # Check if completely linked
+                linked = True
+                while Na_minus_Nb:
+                    u = Na_minus_Nb & -Na_minus_Nb
+                    Na_minus_Nb ^= u
+                    if Nb_minus_Na & ~masks[u.bit_length() - 1]:
+                        linked = False
+                        break
 
-            # Check if completely linked
-            if all(self.has_edge(u,v) for u in Na_minus_Nb for v in Nb_minus_Na):
-                return True
+                if linked:
+                    if certificate:
+                        return (True, (verts[a], verts[b]))
+                    else:
+                        return True
 
-        return False
+        if certificate:
+            return (False, None)
+        else:
+            return False
     has_magnet._is_alpha_property = True
 
     def is_forbidden_subgraph_free(self):
@@ -1416,7 +3352,7 @@ class INPGraph(Graph):
             sage: G.matching_lower_bound()
             1
         """
-        return self.order() - 2 * self.matching_number()
+        return self.order() - 2 * self.context('matching_number')
     matching_lower_bound._is_lower_bound = True
 
     def residue(self):
@@ -1454,7 +3390,7 @@ class INPGraph(Graph):
             sage: G.caro_wei()
             4/3
         """
-        return sum(1/(1+Integer(d)) for d in self.degree())
+        return sum(1/(1+Integer(d)) for d in self.context('degree'))
     caro_wei._is_lower_bound = True
 
     def seklow(self):
@@ -1473,7 +3409,7 @@ class INPGraph(Graph):
         # TODO: Write tests
         # TODO: Write documentation
         n = Integer(self.order())
-        max_eigenvalue = max(self.spectrum())
+        max_eigenvalue = max(self.context('spectrum'))
         if max_eigenvalue not in QQ:
             max_eigenvalue = RR(max_eigenvalue)
         return n / (1 + max_eigenvalue)
@@ -1521,10 +3457,10 @@ class INPGraph(Graph):
             sage: INPGraph(graphs.CycleGraph(5)).max_even_minus_even_horizontal()
             2
         """
-        if not self.is_connected():
+        if not self.context('is_connected'):
             raise ValueError, "This bound is not defined for disconnected graphs."
 
-        dist = self.distance_all_pairs()
+        dist = self.context('distance_all_pairs')
         even = lambda v: [w for w in self.vertices() if dist[v][w] % 2 == 0]
         eh = lambda v: self.subgraph(even(v)).size()
 
@@ -1556,10 +3492,10 @@ class INPGraph(Graph):
             sage: INPGraph(graphs.CycleGraph(5)).max_odd_minus_odd_horizontal()
             2
         """
-        if not self.is_connected():
+        if not self.context('is_connected'):
             raise ValueError, "This bound is not defined for disconnected graphs."
 
-        dist = self.distance_all_pairs()
+        dist = self.context('distance_all_pairs')
         odd = lambda v: [w for w in self.vertices() if dist[v][w] % 2 == 1]
         oh = lambda v: self.subgraph(odd(v)).size()
 
@@ -1606,7 +3542,7 @@ class INPGraph(Graph):
 
             variance = sum(d(u)/((d(u) + 1)**2) for u in self.vertices()) - \
                        2 * sum(1/((d(u)+1)*(d(v)+1)) for u, v in self.edge_iterator(labels=False)) + \
-                       2 * sum(d_uv(u,v)/((d(u)+1)*(d(v)+1)*(2+d(u)+d(v)-d_uv(u,v))) for u, v in self.complement().edge_iterator(labels=False))
+                       2 * sum(d_uv(u,v)/((d(u)+1)*(d(v)+1)*(2+d(u)+d(v)-d_uv(u,v))) for u, v in self.context('complement').edge_iterator(labels=False))
             
             return n - (expected_size - variance/(n - c - expected_size))
 
@@ -1627,7 +3563,7 @@ class INPGraph(Graph):
             sage: INPGraph(graphs.CompleteGraph(3)).matching_upper_bound()
             2
         """
-        return self.order() - self.matching_number()
+        return self.order() - self.context('matching_number')
     matching_upper_bound._is_upper_bound = True
 
     def fractional_alpha(self):
@@ -1684,13 +3620,23 @@ class INPGraph(Graph):
             sage: G = INPGraph(graphs.PetersenGraph())
             sage: G.lovasz_theta()
             4.0
+
+        The SDP is not solved for graphs of a family with known theta (see
+        :meth:`family`)::
+            sage: from sage.combinat.matrices.latin import back_circulant
+            sage: INPGraph.LatinSquareGraph(back_circulant(12), default_pos=True).lovasz_theta()
+            12.0
         """
+        known = self.family_invariant('lovasz_theta')
+        if known is not None:
+            return round(known, 3)
+
         cvxopt.solvers.options['show_progress'] = False
         cvxopt.solvers.options['abstol'] = float(1e-10)
         cvxopt.solvers.options['reltol'] = float(1e-10)
 
         # The below code assumes vertices are numbered 0, ..., n-1.
-        gc = self.complement().relabel(inplace=False)
+        gc = self.context('complement').relabel(inplace=False)
         n = gc.order()
         m = gc.size()
 
@@ -1789,7 +3735,7 @@ class INPGraph(Graph):
             sage: G.cvetkovic()
             4
         """
-        eigenvalues = self.spectrum()
+        eigenvalues = self.context('spectrum')
         positive = 0
         negative = 0
         zero = 0
@@ -1818,7 +3764,7 @@ class INPGraph(Graph):
             sage: G.annihilation_number()
             3
         """
-        seq = sorted(self.degree())
+        seq = sorted(self.context('degree'))
 
         a = 0
         while sum(seq[:a+1]) <= sum(seq[a+1:]):
@@ -1863,6 +3809,20 @@ class INPGraph(Graph):
         return n - C/2 - Integer(1)/2
     cut_vertices_bound._is_upper_bound = True
 
+    _context_primitives = {
+        'complement':           lambda g: g.complement(),
+        'degree':               lambda g: g.degree(),
+        'degree_profile':       degree_profile,
+        'distance_all_pairs':   lambda g: g.distance_all_pairs(),
+        'is_connected':         lambda g: g.is_connected(),
+        'matching_number':      matching_number,
+        'neighbor_bitsets':     _neighbor_bitsets,
+        'spectrum':             lambda g: g.family_invariant('spectrum') or g.spectrum()
+    }
+
+    # The alpha properties that are alpha-reductions, cheapest first.
+    _alpha_reduction_properties = [has_simplicial_vertex, is_fold_reducible, has_magnet, has_nonempty_KE_part]
+
     _alpha_properties = [has_magnet, Graph.is_perfect, has_simplicial_vertex, is_forbidden_subgraph_free, has_nonempty_KE_part, is_almost_KE, is_fold_reducible]
     _lower_bounds = [angel_campigotto_laforest, Graph.radius, Graph.average_distance, five_fourteenths_lower_bound, max_even_minus_even_horizontal, max_odd_minus_odd_horizontal, matching_lower_bound, residue, average_degree_bound, caro_wei, seklow, wilf, hansen_zheng_lower_bound, harant]
     _upper_bounds = [matching_upper_bound, fractional_alpha, lovasz_theta, kwok, hansen_zheng_upper_bound, min_degree_bound, cvetkovic, annihilation_number, borg, cut_vertices_bound]